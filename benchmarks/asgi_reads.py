@@ -0,0 +1,88 @@
+"""
+Checks the ASGI entry point against SQLite and measures its concurrent reads: the catalog
+GETs run on the aiosqlite engine, everything else on the thread pool with the sync engine,
+and a chunked request body (no content-length) still reaches the view.
+
+    $ python benchmarks/asgi_reads.py [requests]
+
+Runs against a temporary SQLite database and calls asgi.application directly, no server
+needed. Needs aiosqlite and greenlet (pipenv install --dev).
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DB_CONNECTION_STRING'] = 'sqlite:///' + database
+os.environ.setdefault('PASSWORD_WORKERS', '0')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sqlalchemy import event  # noqa: E402
+
+import asgi  # noqa: E402
+from models import db, Planets  # noqa: E402
+
+with asgi.flask_app.app_context():
+    db.create_all()
+    db.session.execute(db.insert(Planets), [{"name": f"planet {i}", "population": i * 1000, "diameter": i} for i in range(REQUESTS)])
+    db.session.commit()
+    sync_engine = db.engine
+
+queries = {"async": 0, "sync": 0}
+event.listen(asgi.engine.sync_engine, 'before_cursor_execute', lambda *args: queries.__setitem__('async', queries['async'] + 1))
+event.listen(sync_engine, 'before_cursor_execute', lambda *args: queries.__setitem__('sync', queries['sync'] + 1))
+
+
+async def call(method, path, body=b'', headers=(), chunk_size=None):
+    """
+    (status, headers, body) of one request, the body is sent in chunks of chunk_size.
+    """
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] if chunk_size else [body]
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1} for index, chunk in enumerate(chunks)]
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(), 'root_path': '',
+        'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+        'client': ('127.0.0.1', 0), 'server': ('test', 80), 'scheme': 'http', 'http_version': '1.1',
+    }
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.application(scope, receive, send)
+    response_headers = dict((name.decode(), value.decode()) for name, value in sent[0]['headers'])
+    return sent[0]['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+async def main():
+    status, headers, body = await call('GET', '/planets/5')
+    assert status == 200 and json.loads(body)['result']['name'] == 'planet 4', (status, body)
+    assert queries == {"async": 1, "sync": 0}, queries
+
+    rows = b''.join(json.dumps({"name": f"new planet {i}", "population": i, "diameter": i}).encode() + b'\n' for i in range(50))
+    status, headers, body = await call('POST', '/planets/bulk', rows, [('content-type', 'application/x-ndjson'), ('transfer-encoding', 'chunked')], chunk_size=256)
+    assert status == 200 and json.loads(body)['created'] == 50, (status, body)
+
+    status, headers, body = await call('GET', '/planets?stream=1', headers=[('accept', 'application/x-ndjson')])
+    assert status == 200 and len(body.splitlines()) == REQUESTS + 50, (status, len(body.splitlines()))
+
+    before = dict(queries)
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[call('GET', f'/planets/{id}') for id in range(1, REQUESTS + 1)])
+    elapsed = time.perf_counter() - start
+    assert set(status for status, headers, body in responses) == {200}
+    assert queries['sync'] == before['sync'], "the catalog GETs read through the sync engine"
+
+    print(f"{REQUESTS} concurrent GET /planets/<id> in {elapsed:.2f} s, {queries['async'] - before['async']} queries on the async engine")
+    print("chunked NDJSON bulk insert and streamed list through the thread pool: ok")
+
+asyncio.run(main())
@@ -0,0 +1,57 @@
+"""
+Per-row cost of the list endpoints' read path: ORM instances + serialize() against
+plain column rows mapped to dicts (utils.select_rows / utils.serialize_rows).
+
+    $ python benchmarks/list_reads.py [rows]
+
+Runs against a temporary SQLite database, no server or MySQL needed.
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+REPEAT = 5
+
+database = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DB_CONNECTION_STRING'] = 'sqlite:///' + database
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from main import create_app  # noqa: E402
+from models import db, Planets  # noqa: E402
+from utils import select_rows, serialize_rows  # noqa: E402
+
+app = create_app({"ADMIN_ENABLED": False, "MIGRATE_ENABLED": False})
+
+
+def orm_read():
+    return list(map(lambda x: x.serialize(), Planets.query.order_by(Planets.id).all()))
+
+def row_read():
+    return serialize_rows(select_rows(Planets.query, Planets).order_by(Planets.id).all(), Planets)
+
+def best_of(read):
+    best = None
+    for _ in range(REPEAT):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        read()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+with app.test_request_context('/planets'):
+    db.create_all()
+    db.session.execute(db.insert(Planets), [{"name": f"planet {i}", "population": i * 1000, "diameter": i} for i in range(ROWS)])
+    db.session.commit()
+
+    assert orm_read() == row_read()
+    orm = best_of(orm_read)
+    rows = best_of(row_read)
+
+print(f"{ROWS} rows, best of {REPEAT}")
+print(f"ORM instances + serialize(): {orm * 1e6 / ROWS:.2f} us/row")
+print(f"plain rows + serialize_rows(): {rows * 1e6 / ROWS:.2f} us/row")
+print(f"speedup: {orm / rows:.1f}x")
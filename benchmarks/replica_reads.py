@@ -0,0 +1,81 @@
+"""
+Checks the read replica routing with SQLite files standing in for the primary and two
+replicas: GETs take turns on the replicas, a client that wrote reads from the primary for
+REPLICA_READ_YOUR_WRITES seconds, and a broken replica is ejected while the read that
+hit it still answers from the primary.
+
+    $ python benchmarks/replica_reads.py
+
+The replicas are copies of the primary file, like a replication snapshot. Every copy
+gets its own name for the first planet, so a response shows which database served it.
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+directory = tempfile.mkdtemp()
+primary, replicas = os.path.join(directory, 'primary.db'), [os.path.join(directory, f'replica{i}.db') for i in (1, 2)]
+os.environ['DB_CONNECTION_STRING'] = 'sqlite:///' + primary
+os.environ['DB_REPLICA_URLS'] = ','.join('sqlite:///' + path for path in replicas)
+os.environ['REPLICA_READ_YOUR_WRITES'] = '1'
+os.environ.setdefault('PASSWORD_WORKERS', '0')
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from cache import entity_cache, response_cache  # noqa: E402
+from main import create_app  # noqa: E402
+from models import db, Planets, User  # noqa: E402
+from passwords import passwords  # noqa: E402
+
+app = create_app({"ADMIN_ENABLED": False, "MIGRATE_ENABLED": False, "METRICS_ENABLED": False})
+client = app.test_client()
+
+with app.app_context():
+    db.create_all()
+    db.session.execute(db.insert(Planets), [{"name": f"planet {i}", "population": i, "diameter": i} for i in range(10)])
+    db.session.add(User(email='luke@x.com', username='luke', password=passwords.generate_password_hash('pw'), is_active=True))
+    db.session.commit()
+    db.session.remove()
+    for engine in db.engines.values():
+        engine.dispose()
+
+for index, path in enumerate(replicas):
+    shutil.copy(primary, path)
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE planets SET name = ? WHERE id = 1", (f"replica_{index}",))
+# the tables this worker just wrote are read from the primary for REPLICA_READ_YOUR_WRITES
+time.sleep(1.1)
+
+
+def served_by():
+    # the caches would answer without asking any database
+    entity_cache.clear()
+    response_cache.clear()
+    response = client.get('/planets/1')
+    assert response.status_code == 200, response.get_data()
+    return response.get_json()['result']['name']
+
+
+names = [served_by() for _ in range(4)]
+assert names == ['replica_0', 'replica_1', 'replica_0', 'replica_1'], names
+print("round-robin:", names)
+
+token = client.post('/login', json={'email': 'luke@x.com', 'password': 'pw'}).get_json()['access_token']
+response = client.post('/users/favorites/planets', json={'user_id': 1, 'planets_id': 2}, headers={'Authorization': 'Bearer ' + token})
+assert response.status_code == 200 and 'db_primary_until=' in response.headers.get('Set-Cookie', ''), response.headers
+assert served_by() == 'planet 0'
+time.sleep(1.1)
+assert served_by().startswith('replica_')
+print("read your writes: the writer reads the primary for 1 s, then the replicas again")
+
+with sqlite3.connect(replicas[1]) as connection:
+    connection.execute("DROP TABLE planets")
+names = [served_by() for _ in range(4)]
+stats = client.get('/stats/replicas').get_json()
+assert 'planet 0' in names and 'replica_1' not in names, names
+assert stats['replica_1']['healthy'] is False and stats['replica_1']['ejections'] == 1, stats
+assert names[-2:] == ['replica_0', 'replica_0'], names
+print("ejection: the read that hit the broken replica came from the primary, then", names[-2:])
@@ -0,0 +1,72 @@
+"""
+Startup cost of the web app: time to import wsgi.py and the memory of every gunicorn
+worker, with and without preload.
+
+    $ python benchmarks/startup.py [src dir] [workers]
+
+Needs gunicorn and Linux (memory is read from /proc/<pid>/smaps_rollup). RSS counts the
+pages shared with the master, PSS splits them between the processes sharing them and USS
+is what only that worker holds.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+SRC = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+WORKERS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+REPEAT = 5
+PORT = 8765
+
+env = dict(os.environ, DB_CONNECTION_STRING='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+
+
+def import_time():
+    code = "import time; start = time.perf_counter(); import wsgi; print(time.perf_counter() - start)"
+    return min(float(subprocess.check_output([sys.executable, '-c', code], cwd=SRC, env=env, stderr=subprocess.DEVNULL)) for _ in range(REPEAT))
+
+def memory(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    private = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values['Rss'] / 1024, values['Pss'] / 1024, private / 1024
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as file:
+        return [int(child) for child in file.read().split()]
+
+def serve(preload):
+    command = [sys.executable, '-m', 'gunicorn', '--chdir', SRC, '-w', str(WORKERS), '-b', f'127.0.0.1:{PORT}', 'wsgi']
+    if preload:
+        command.insert(3, '--preload')
+    master = subprocess.Popen(command, env=dict(env, GUNICORN_PRELOAD=str(preload)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        start = time.perf_counter()
+        while True:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{PORT}/').read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready = time.perf_counter() - start
+        # every worker serves a few requests before it's measured
+        for _ in range(WORKERS * 20):
+            urllib.request.urlopen(f'http://127.0.0.1:{PORT}/').read()
+        time.sleep(0.5)
+        workers = [memory(pid) for pid in children(master.pid)]
+    finally:
+        master.terminate()
+        master.wait()
+    return ready, [sum(values) / len(values) for values in zip(*workers)]
+
+
+print(f"import wsgi: {import_time() * 1000:.0f} ms")
+for preload in (False, True):
+    ready, (rss, pss, uss) = serve(preload)
+    print(f"{'preload' if preload else 'no preload'}: {WORKERS} workers ready in {ready:.2f} s, per worker RSS {rss:.1f} MB, PSS {pss:.1f} MB, USS {uss:.1f} MB")
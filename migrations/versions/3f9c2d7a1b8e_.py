@@ -0,0 +1,40 @@
+"""unique favorites per user
+
+Revision ID: 3f9c2d7a1b8e
+Revises: 51b4145d41bb
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2d7a1b8e'
+down_revision = '51b4145d41bb'
+branch_labels = None
+depends_on = None
+
+
+FAVORITE_TABLES = [
+    ('favorite_character', 'character_id'),
+    ('favorite_vehicles', 'vehicles_id'),
+    ('favorite_planets', 'planets_id'),
+]
+
+
+def upgrade():
+    for table, column in FAVORITE_TABLES:
+        # keep the oldest row of every (user, item) pair, otherwise the unique index can't be built
+        op.execute(
+            f"DELETE FROM {table} WHERE id NOT IN ("
+            f"SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM {table} GROUP BY user_id, {column}) AS keep)"
+        )
+        op.create_index(f'ix_{table}_user_id_{column}', table, ['user_id', column], unique=True)
+        op.create_index(f'ix_{table}_user_id', table, ['user_id'], unique=False)
+
+
+def downgrade():
+    for table, column in reversed(FAVORITE_TABLES):
+        op.drop_index(f'ix_{table}_user_id', table_name=table)
+        op.drop_index(f'ix_{table}_user_id_{column}', table_name=table)
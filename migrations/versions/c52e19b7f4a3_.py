@@ -0,0 +1,96 @@
+"""single favorite table for every kind of item
+
+Revision ID: c52e19b7f4a3
+Revises: 8a41e6c0d2f5
+Create Date: 2026-10-18 17:05:42.630518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e19b7f4a3'
+down_revision = '8a41e6c0d2f5'
+branch_labels = None
+depends_on = None
+
+
+# (kind, old table, item table, item column)
+FAVORITE_TABLES = [
+    ('character', 'favorite_character', 'character', 'character_id'),
+    ('vehicle', 'favorite_vehicles', 'vehicles', 'vehicles_id'),
+    ('planet', 'favorite_planets', 'planets', 'planets_id'),
+]
+
+
+def upgrade():
+    op.create_table('favorite',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_favorite_user_id_kind_item_id', 'favorite', ['user_id', 'kind', 'item_id'], unique=True)
+    op.create_index('ix_favorite_user_id_kind_created_at_item_id', 'favorite', ['user_id', 'kind', 'created_at', 'item_id'], unique=False)
+
+    # the old tables have no dates, the rows keep their order through the new ids
+    for kind, table, item_table, column in FAVORITE_TABLES:
+        op.execute(
+            f"INSERT INTO favorite (user_id, kind, item_id, created_at) "
+            f"SELECT user_id, '{kind}', {column}, CURRENT_TIMESTAMP FROM {table} "
+            f"WHERE user_id IS NOT NULL AND {column} IS NOT NULL ORDER BY id"
+        )
+    # a row of the old favorites table can hold one item of each kind, and repeat what
+    # the typed tables already have
+    for kind, table, item_table, column in FAVORITE_TABLES:
+        op.execute(
+            f"INSERT INTO favorite (user_id, kind, item_id, created_at) "
+            f"SELECT user_id, '{kind}', {column}, CURRENT_TIMESTAMP FROM favorites AS old "
+            f"WHERE user_id IS NOT NULL AND {column} IS NOT NULL AND NOT EXISTS ("
+            f"SELECT 1 FROM favorite WHERE favorite.user_id = old.user_id AND favorite.kind = '{kind}' AND favorite.item_id = old.{column}) "
+            f"GROUP BY user_id, {column} ORDER BY MIN(id)"
+        )
+
+    op.drop_table('favorites')
+    for kind, table, item_table, column in FAVORITE_TABLES:
+        op.drop_table(table)
+
+
+def downgrade():
+    for kind, table, item_table, column in FAVORITE_TABLES:
+        op.create_table(table,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column(column, sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint([column], [f'{item_table}.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index(f'ix_{table}_user_id_{column}', table, ['user_id', column], unique=True)
+        op.create_index(f'ix_{table}_user_id', table, ['user_id'], unique=False)
+        # favorites of items deleted meanwhile would break the foreign key
+        op.execute(
+            f"INSERT INTO {table} (user_id, {column}) "
+            f"SELECT user_id, item_id FROM favorite "
+            f"WHERE kind = '{kind}' AND item_id IN (SELECT id FROM {item_table}) ORDER BY created_at, id"
+        )
+    op.create_table('favorites',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('character_id', sa.Integer(), nullable=True),
+    sa.Column('vehicles_id', sa.Integer(), nullable=True),
+    sa.Column('planets_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['character_id'], ['character.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['planets_id'], ['planets.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['vehicles_id'], ['vehicles.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    op.drop_index('ix_favorite_user_id_kind_created_at_item_id', table_name='favorite')
+    op.drop_index('ix_favorite_user_id_kind_item_id', table_name='favorite')
+    op.drop_table('favorite')
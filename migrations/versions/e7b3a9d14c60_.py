@@ -0,0 +1,35 @@
+"""favorite counts per item
+
+Revision ID: e7b3a9d14c60
+Revises: c52e19b7f4a3
+Create Date: 2026-10-18 18:21:07.915342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3a9d14c60'
+down_revision = 'c52e19b7f4a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('favorite_count',
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('item_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'item_id')
+    )
+    op.create_index('ix_favorite_count_kind_count_item_id', 'favorite_count', ['kind', 'count', 'item_id'], unique=False)
+    op.execute(
+        "INSERT INTO favorite_count (kind, item_id, count) "
+        "SELECT kind, item_id, COUNT(*) FROM favorite GROUP BY kind, item_id"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_favorite_count_kind_count_item_id', table_name='favorite_count')
+    op.drop_table('favorite_count')
@@ -1,9 +1,11 @@
 import os
-from flask_admin import Admin
-from models import db, User, Planets, Character, Vehicles, Favorites, FavoriteVehicles, FavoritePlanets, FavoriteCharacter
-from flask_admin.contrib.sqla import ModelView
+from models import db, User, Planets, Character, Vehicles, Favorite
 
 def setup_admin(app):
+    # flask_admin pulls in wtforms and pkg_resources, only apps with the admin enabled pay for them
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
@@ -14,10 +16,7 @@ def setup_admin(app):
     admin.add_view(ModelView(Planets, db.session))
     admin.add_view(ModelView(Character, db.session))
     admin.add_view(ModelView(Vehicles, db.session))
-    admin.add_view(ModelView(Favorites, db.session))
-    admin.add_view(ModelView(FavoriteVehicles, db.session))
-    admin.add_view(ModelView(FavoritePlanets, db.session))
-    admin.add_view(ModelView(FavoriteCharacter, db.session))
+    admin.add_view(ModelView(Favorite, db.session))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
@@ -0,0 +1,200 @@
+"""
+ASGI entry point, run from src/ with an ASGI server:
+
+    $ uvicorn asgi:application --workers 2
+
+The catalog and favorites GETs run on the event loop. Their Flask view runs inside
+AsyncSession.run_sync with the request's db.session backed by an async driver, so while a
+query waits on the database the loop serves other requests. A process keeps as many reads
+in flight as the async pool has connections (ASYNC_DB_POOL_SIZE + ASYNC_DB_MAX_OVERFLOW).
+Everything else (writes, login, admin, streamed lists) goes to the same Flask app on a
+pool of ASGI_THREADS threads.
+
+Needs greenlet and the async driver of the database: aiosqlite for sqlite:// (local
+development), aiomysql for mysql:// or asyncpg for postgresql://. ASYNC_DB_CONNECTION_STRING
+overrides the URL derived from DB_CONNECTION_STRING.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+from db_pool import async_engine_options, enforce_foreign_keys
+from main import create_app
+from models import db
+from utils import wants_stream
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 8))
+ASYNC_DRIVERS = {
+    'sqlite': 'aiosqlite',
+    'mysql': 'aiomysql',
+    'postgresql': 'asyncpg',
+}
+ASYNC_ENDPOINTS = {
+    'api.get_all_planets', 'api.handle_planet_id', 'api.get_popular_planets',
+    'api.get_all_character', 'api.handle_character_id', 'api.get_popular_character',
+    'api.get_all_vehicles', 'api.handle_vehicles_id', 'api.get_popular_vehicles',
+    'api.get_all_favcharacters', 'api.handle_favchar_id',
+    'api.get_all_favvehicles', 'api.handle_favvehicles_id',
+    'api.get_all_favplanets', 'api.handle_favplanets_id',
+    'api.get_favorites',
+}
+SESSION_KEY = 'starwars.async_session'
+
+
+def async_database_uri(database_uri):
+    if os.environ.get('ASYNC_DB_CONNECTION_STRING'):
+        return os.environ['ASYNC_DB_CONNECTION_STRING']
+    url = make_url(database_uri)
+    return url.set(drivername=f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}").render_as_string(hide_password=False)
+
+
+flask_app = create_app({"MIGRATE_ENABLED": False})
+database_uri = async_database_uri(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(database_uri, **async_engine_options(database_uri))
+enforce_foreign_keys(engine.sync_engine)
+executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='wsgi')
+
+
+def use_async_session():
+    # runs before any other hook touches db.session, so the whole request reads through it
+    session = request.environ.get(SESSION_KEY)
+    if session is not None:
+        db.session.registry.set(session)
+
+flask_app.before_request_funcs.setdefault(None, []).insert(0, use_async_session)
+
+
+##----------------------------------WSGI bridge-------------------------------------
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in environ:
+            # HTTP/2 clients send every cookie as its own header, cookies are separated by '; '
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    # the body is already read whole, a chunked request has no content-length of its own
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+class StartResponse:
+    def __call__(self, status, headers, exc_info=None):
+        self.status = int(status.split(' ', 1)[0])
+        self.headers = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+async def read_body(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+def runs_async(environ):
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        return False
+    try:
+        endpoint, view_args = flask_app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return False
+    # a streamed body is written after the view returns, outside of the session's greenlet
+    return endpoint in ASYNC_ENDPOINTS and not wants_stream(Request(environ))
+
+
+##----------------------------------dispatch-------------------------------------
+
+
+def call_app(session, environ):
+    environ[SESSION_KEY] = session
+    start_response = StartResponse()
+    result = flask_app.wsgi_app(environ, start_response)
+    try:
+        return start_response, b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+async def run_async(environ, send):
+    async with AsyncSession(engine) as session:
+        start_response, body = await session.run_sync(call_app, environ)
+    await send({'type': 'http.response.start', 'status': start_response.status, 'headers': start_response.headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def run_in_thread(environ, send):
+    loop = asyncio.get_running_loop()
+    # every step of the request runs in this context, so a streamed body still sees its request
+    context = contextvars.copy_context()
+    start_response = StartResponse()
+    result = await loop.run_in_executor(executor, context.run, flask_app.wsgi_app, environ, start_response)
+    try:
+        chunks = iter(result)
+        await send({'type': 'http.response.start', 'status': start_response.status, 'headers': start_response.headers})
+        while True:
+            chunk = await loop.run_in_executor(executor, context.run, next, chunks, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(executor, context.run, result.close)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        raise NotImplementedError(f"Unsupported ASGI scope {scope['type']}")
+
+    environ = build_environ(scope, await read_body(receive))
+    if runs_async(environ):
+        await run_async(environ, send)
+    else:
+        await run_in_thread(environ, send)
@@ -0,0 +1,124 @@
+"""
+Bulk creation of catalog rows: the request body is a JSON array or NDJSON, every row is
+validated before touching the database and valid rows are inserted with multi-row
+INSERT statements inside a single transaction.
+"""
+import json
+
+from flask import request
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+from utils import APIException
+
+BULK_MAX_ROWS = 50000
+BULK_BATCH_SIZE = 1000
+
+
+def read_rows():
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            rows = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            raise APIException("Every line of the body must be a json object", status_code=400)
+    else:
+        rows = request.get_json(silent=True)
+
+    if not isinstance(rows, list):
+        raise APIException("You need to specify the request body as a json array or ndjson", status_code=400)
+    if len(rows) > BULK_MAX_ROWS:
+        raise APIException(f"You can create up to {BULK_MAX_ROWS} rows per request", status_code=413)
+    return rows
+
+def validate_row(model, row):
+    if not isinstance(row, dict):
+        return "Each row must be a json object"
+
+    for name in row:
+        if name == 'id' or name not in model.__table__.columns:
+            return f"Unknown field {name}"
+
+    for column in model.__table__.columns:
+        if column.primary_key:
+            continue
+        value = row.get(column.name)
+        if value is None:
+            if not column.nullable:
+                return f"Missing field {column.name}"
+        elif isinstance(column.type, db.Integer):
+            if not isinstance(value, int) or isinstance(value, bool):
+                return f"{column.name} must be a number"
+        elif isinstance(column.type, db.String):
+            if not isinstance(value, str):
+                return f"{column.name} must be a string"
+            if column.type.length and len(value) > column.type.length:
+                return f"{column.name} is too long"
+    return None
+
+def find_existing(column, values):
+    existing = set()
+    for start in range(0, len(values), BULK_BATCH_SIZE):
+        chunk = values[start:start + BULK_BATCH_SIZE]
+        existing.update(value for (value,) in db.session.query(column).filter(column.in_(chunk)))
+    return existing
+
+def bulk_create(model):
+    """
+    Returns one result per row of the request, in the same order. Rows that fail the
+    validation are reported and skipped, the rest are inserted in one transaction.
+    """
+    rows = read_rows()
+    results = [{"index": index} for index in range(len(rows))]
+    valid = []
+
+    for index, row in enumerate(rows):
+        error = validate_row(model, row)
+        if error is not None:
+            results[index].update(status="error", message=error)
+        else:
+            valid.append(index)
+
+    # unique columns are checked against the request itself and against the table
+    for column in model.__table__.columns:
+        if not column.unique:
+            continue
+        values = [rows[index][column.name] for index in valid]
+        taken = find_existing(getattr(model, column.name), values)
+        seen = set()
+        kept = []
+        for index in valid:
+            value = rows[index][column.name]
+            if value in taken or value in seen:
+                results[index].update(status="error", message=f"{column.name} {value} already exists")
+            else:
+                kept.append(index)
+            seen.add(value)
+        valid = kept
+
+    fields = [column.name for column in model.__table__.columns if not column.primary_key]
+    try:
+        for start in range(0, len(valid), BULK_BATCH_SIZE):
+            batch = [dict((name, rows[index].get(name)) for name in fields) for index in valid[start:start + BULK_BATCH_SIZE]]
+            db.session.execute(insert(model).values(batch))
+        db.session.commit()
+    except IntegrityError:
+        # another request inserted one of the names after the validation
+        db.session.rollback()
+        raise APIException("Some rows were created by another request, nothing was inserted", status_code=409)
+
+    # every catalog model has a unique name, so the new ids are read back by name
+    # instead of relying on RETURNING, which MySQL doesn't support
+    names = [rows[index]['name'] for index in valid]
+    ids = {}
+    for start in range(0, len(names), BULK_BATCH_SIZE):
+        chunk = names[start:start + BULK_BATCH_SIZE]
+        ids.update(db.session.query(model.name, model.id).filter(model.name.in_(chunk)).all())
+    for index in valid:
+        results[index].update(status="created", id=ids.get(rows[index]['name']))
+
+    return {
+        "created": len(valid),
+        "errors": len(rows) - len(valid),
+        "results": results
+    }
@@ -0,0 +1,257 @@
+"""
+In-process caches for the API. They are invalidated from SQLAlchemy session events,
+so the views that write to the database don't need to know the caches exist.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, make_response
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import event, inspect
+
+from models import db, User
+from utils import APIException, wants_stream
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+# every gunicorn worker has its own copy, the TTL bounds how long a worker that didn't
+# see a write can keep serving the old body
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 30))
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get('RESPONSE_CACHE_MAX_AGE', 0))
+ENTITY_CACHE_SIZE = int(os.environ.get('ENTITY_CACHE_SIZE', 10000))
+ENTITY_CACHE_TTL = int(os.environ.get('ENTITY_CACHE_TTL', 60))
+IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+# like the response TTL, bounds how long the other workers see a deleted or deactivated user
+IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 60))
+UNCACHED_HEADERS = ('Content-Type', 'Content-Length', 'Set-Cookie')
+
+
+class LRUCache:
+    """
+    Bounded mapping with least-recently-used eviction and a time to live per entry.
+    Thread safe, counts hits, misses and evictions.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] < time.monotonic():
+                del self._entries[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+class CachedResponse:
+    def __init__(self, body, mimetype, headers):
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers
+        self.etag = hashlib.sha1(body).hexdigest()
+        # body per content encoding, filled by the compression hook the first time it's asked
+        self.compressed = {}
+
+
+class ResponseCache(LRUCache):
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        LRUCache.__init__(self, max_size, ttl)
+
+    def invalidate(self, table):
+        self.delete_where(lambda key: key[0] == table)
+
+
+class EntityCache(LRUCache):
+    """
+    Serialized rows keyed by (table, id), so by-id endpoints don't hit the database.
+    """
+    def __init__(self, max_size=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL):
+        LRUCache.__init__(self, max_size, ttl)
+
+    def get_serialized(self, model, id):
+        key = (model.__table__.name, id)
+        serialized = self.get(key)
+        if serialized is None:
+            obj = db.session.get(model, id)
+            if obj is None:
+                return None
+            serialized = self.set(key, obj.serialize())
+        return serialized
+
+    def get_many_serialized(self, model, ids):
+        """
+        {id: serialized row} of the ids that exist. The ones that aren't cached are
+        loaded with a single IN query.
+        """
+        table = model.__table__.name
+        found = {}
+        for id in ids:
+            serialized = self.get((table, id))
+            if serialized is not None:
+                found[id] = serialized
+        missing = [id for id in ids if id not in found]
+        if missing:
+            for obj in db.session.query(model).filter(model.id.in_(missing)):
+                found[obj.id] = self.set((table, obj.id), obj.serialize())
+        return found
+
+    def invalidate(self, table, id=None):
+        if id is None:
+            self.delete_where(lambda key: key[0] == table)
+        else:
+            self.delete((table, id))
+
+
+class IdentityCache(LRUCache):
+    """
+    JWT identity (the user email) resolved to (user id, is_active), keyed by the token jti.
+    Entries expire after IDENTITY_CACHE_TTL, or with their token when it expires sooner.
+    """
+    def __init__(self, max_size=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL):
+        LRUCache.__init__(self, max_size, ttl)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, item in self._entries.items() if user_id is None or item[0][0] == user_id]:
+                del self._entries[key]
+
+
+response_cache = ResponseCache()
+entity_cache = EntityCache()
+identity_cache = IdentityCache()
+
+
+def current_user_id():
+    """
+    Id of the user of the current access token. Only the first request made with a token
+    looks the user up, the following ones are served from the identity cache.
+    """
+    claims = get_jwt()
+    user = identity_cache.get(claims['jti'])
+    if user is None:
+        row = db.session.query(User.id, User.is_active).filter(User.email == get_jwt_identity()).first()
+        if row is None:
+            raise APIException("El usuario no existe", status_code=401)
+        user = identity_cache.set(claims['jti'], (row.id, row.is_active), ttl=min(claims['exp'] - time.time(), identity_cache.ttl))
+
+    user_id, is_active = user
+    if not is_active:
+        raise APIException("This user is not active", status_code=401)
+    return user_id
+
+
+def cached_response(table):
+    """
+    Caches the body of a successful GET together with a strong ETag. A request whose
+    If-None-Match matches the cached ETag gets a 304 without running the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if wants_stream():
+                return view(*args, **kwargs)
+
+            key = (table, request.full_path)
+            entry = response_cache.get(key)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                headers = [(name, value) for name, value in response.headers if name not in UNCACHED_HEADERS]
+                entry = response_cache.set(key, CachedResponse(response.get_data(), response.mimetype, headers))
+            else:
+                response = make_response(entry.body)
+                response.mimetype = entry.mimetype
+                response.headers.extend(entry.headers)
+
+            g.cached_response = entry
+            response.set_etag(entry.etag)
+            response.cache_control.public = True
+            response.cache_control.max_age = RESPONSE_CACHE_MAX_AGE
+            response.cache_control.must_revalidate = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+##----------------------------------invalidation-------------------------------------
+
+
+# callables (table, id) run for every row changed by a commit, so other per-worker
+# structures can follow the writes the same way the caches do
+commit_hooks = []
+
+def _changed(session):
+    # (table, id) of every changed row, id is None when a whole table may have changed
+    return session.info.setdefault('changed_rows', set())
+
+@event.listens_for(db.session, 'after_flush')
+def collect_flushed_rows(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        # the primary key of new rows is known here, their identity key isn't yet
+        _changed(session).add((obj.__table__.name, inspect(obj).mapper.primary_key_from_instance(obj)[0]))
+
+@event.listens_for(db.session, 'do_orm_execute')
+def collect_bulk_tables(orm_execute_state):
+    # INSERT/UPDATE/DELETE statements executed directly don't go through the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _changed(orm_execute_state.session).add((orm_execute_state.statement.table.name, None))
+
+@event.listens_for(db.session, 'after_commit')
+def invalidate_committed_rows(session):
+    for table, id in session.info.pop('changed_rows', ()):
+        response_cache.invalidate(table)
+        entity_cache.invalidate(table, id)
+        if table == User.__table__.name:
+            identity_cache.invalidate_user(id)
+        for hook in commit_hooks:
+            hook(table, id)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_rolled_back_rows(session):
+    session.info.pop('changed_rows', None)
@@ -0,0 +1,141 @@
+"""
+Compression of the response bodies, negotiated on Accept-Encoding.
+
+gzip is always available, brotli and zstd are used when their packages are installed.
+Bodies smaller than COMPRESSION_MIN_SIZE go out as they are, compressing them costs more
+than it saves. Streamed responses are compressed chunk by chunk, and the compressed bodies
+of cached responses are kept next to the cached body so each encoding is only computed once.
+"""
+import os
+import zlib
+
+from flask import g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# a streamed body is flushed to the client every time this much was compressed
+COMPRESSION_STREAM_FLUSH = int(os.environ.get('COMPRESSION_STREAM_FLUSH', 16384))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain')
+
+
+class GzipEncoder:
+    def __init__(self):
+        # wbits 31 writes the gzip header, with no file name or time so the output is stable
+        self._compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self):
+        # brotli levels go up to 11, the highest ones are far too slow for a response
+        self._compressor = brotli.Compressor(quality=min(COMPRESSION_LEVEL, 11) - 1)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=max(COMPRESSION_LEVEL - 3, 1)).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+# in order of preference when the client accepts several with the same quality
+ENCODERS = dict(
+    [('br', BrotliEncoder)] * (brotli is not None) +
+    [('zstd', ZstdEncoder)] * (zstandard is not None) +
+    [('gzip', GzipEncoder)]
+)
+
+
+def compress(body, encoding):
+    encoder = ENCODERS[encoding]()
+    return encoder.compress(body) + encoder.finish()
+
+def compress_stream(chunks, encoding):
+    encoder = ENCODERS[encoding]()
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = encoder.compress(chunk)
+        pending += len(chunk)
+        # the encoder keeps small chunks to itself, flush regularly so rows keep flowing
+        if pending >= COMPRESSION_STREAM_FLUSH:
+            data += encoder.flush()
+            pending = 0
+        if data:
+            yield data
+    yield encoder.finish()
+
+def negotiate_encoding():
+    return request.accept_encodings.best_match(list(ENCODERS))
+
+
+def setup_compression(app):
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 304) or request.method == 'HEAD':
+            return response
+        response.vary.add('Accept-Encoding')
+
+        encoding = negotiate_encoding()
+        if encoding is None or response.direct_passthrough:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            if response.content_length is not None and response.content_length < COMPRESSION_MIN_SIZE:
+                return response
+            # set by cached_response when this body is the one in the response cache
+            entry = g.get('cached_response')
+            if entry is not None and response.status_code == 200:
+                body = entry.compressed.get(encoding)
+                if body is None:
+                    body = entry.compressed[encoding] = compress(entry.body, encoding)
+            else:
+                body = compress(response.get_data(), encoding)
+            response.set_data(body)
+
+        response.headers['Content-Encoding'] = encoding
+        # the compressed body is a different representation, so its validator can only be weak
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,119 @@
+"""
+Connection pool configuration from environment variables and live pool statistics.
+
+A sync gunicorn worker serves one request per thread, so each worker only needs as many
+connections as threads. The database sees at most workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS', 1))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', GUNICORN_THREADS + 1))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', GUNICORN_THREADS))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+# below MySQL's default wait_timeout, so the server never drops a connection we still hold
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# an ASGI process holds one connection per read in flight instead of one per thread
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 50))
+ASYNC_DB_MAX_OVERFLOW = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW', 150))
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that measures how long checkouts wait for a free connection.
+    """
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def turn_on_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+def enforce_foreign_keys(engine):
+    # SQLite only checks foreign keys on the connections that turn them on. The migrations
+    # build their own engine and keep them off, so rebuilding a table doesn't cascade.
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', turn_on_foreign_keys)
+
+
+def engine_options(database_uri):
+    options = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    # sqlite uses its own pools that don't take a size
+    if database_uri and not database_uri.startswith('sqlite'):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return options
+
+def async_engine_options(database_uri):
+    options = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    # an in-memory sqlite database lives in a single connection
+    if make_url(database_uri).database not in (None, '', ':memory:'):
+        options.update(
+            pool_size=ASYNC_DB_POOL_SIZE,
+            max_overflow=ASYNC_DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return options
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {
+        "pool": pool.__class__.__name__,
+        "status": pool.status()
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            max_overflow=pool._max_overflow,
+            timeout=pool.timeout()
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            checkouts=pool.checkouts,
+            checkout_timeouts=pool.timeouts,
+            wait_seconds_total=round(pool.wait_total, 6),
+            wait_seconds_max=round(pool.wait_max, 6),
+            wait_seconds_avg=round(pool.wait_total / pool.checkouts, 6) if pool.checkouts else 0.0
+        )
+    return stats
@@ -0,0 +1,253 @@
+"""
+Reads and writes of the favorites of one user, all kinds are stored in the favorite table.
+Every write also moves the favorite counts of the items in the same transaction.
+"""
+from sqlalchemy import event, func, insert, update, delete, and_, or_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Planets, Character, Vehicles, Favorite, FavoriteCount
+from cache import entity_cache
+from utils import APIException
+
+FAVORITES_BATCH_MAX = 500
+POPULAR_DEFAULT_LIMIT = 10
+POPULAR_MAX_LIMIT = 100
+
+# kind -> (item model, key of the item id in the responses, key of the embedded item)
+FAVORITE_KINDS = {
+    "character": (Character, "character_id", "character"),
+    "vehicle": (Vehicles, "vehicle_id", "vehicle"),
+    "planet": (Planets, "planets_id", "planet"),
+}
+FAVORITE_OPS = ("add", "remove")
+
+
+def matching(model, keys):
+    # WHERE over a list of (kind, item_id)
+    item_ids = {}
+    for kind, item_id in keys:
+        item_ids.setdefault(kind, set()).add(item_id)
+    return or_(*[and_(model.kind == kind, model.item_id.in_(ids)) for kind, ids in item_ids.items()])
+
+def upsert(dialect):
+    for module in (mysql, postgresql, sqlite):
+        if module.dialect.name == dialect.name:
+            return module.insert
+    raise NotImplementedError(f"Favorite counts can't be written on {dialect.name}")
+
+def update_counts(connection, added=(), removed=()):
+    """
+    Adds one to the count of every (kind, item_id) in added and takes one from the ones in
+    removed. Runs on the connection of the transaction that writes the favorites.
+    """
+    if added:
+        statement = upsert(connection.dialect)(FavoriteCount).values([{"kind": kind, "item_id": item_id, "count": 1} for kind, item_id in added])
+        if connection.dialect.name == 'mysql':
+            statement = statement.on_duplicate_key_update(count=FavoriteCount.count + 1)
+        else:
+            statement = statement.on_conflict_do_update(index_elements=['kind', 'item_id'], set_={"count": FavoriteCount.count + 1})
+        connection.execute(statement)
+    if removed:
+        connection.execute(update(FavoriteCount).where(matching(FavoriteCount, removed), FavoriteCount.count > 0).values(count=FavoriteCount.count - 1))
+
+def serialize_favorite(favorite):
+    item_model, id_key, item_key = FAVORITE_KINDS[favorite.kind]
+    return {"id": favorite.id, id_key: favorite.item_id, "user_id": favorite.user_id, "created_at": favorite.created_at}
+
+def user_favorites(user_id, kind=None):
+    """
+    {kind: [favorite with its item]} of the user, oldest first. The favorites are one range
+    scan over the (user_id, kind, created_at, item_id) index, the items come from the entity
+    cache, with one IN query per kind for the ones that aren't cached.
+    """
+    query = db.session.query(Favorite.id, Favorite.user_id, Favorite.kind, Favorite.item_id, Favorite.created_at).filter(Favorite.user_id == user_id)
+    if kind is not None:
+        query = query.filter(Favorite.kind == kind)
+    rows = query.order_by(Favorite.kind, Favorite.created_at, Favorite.id).all()
+
+    favorites = dict((name, []) for name in FAVORITE_KINDS if kind in (None, name))
+    items = {}
+    for name in favorites:
+        item_ids = [row.item_id for row in rows if row.kind == name]
+        items[name] = entity_cache.get_many_serialized(FAVORITE_KINDS[name][0], item_ids) if item_ids else {}
+    for row in rows:
+        item = items.get(row.kind, {}).get(row.item_id)
+        if item is not None:
+            favorites[row.kind].append(dict(serialize_favorite(row), **{FAVORITE_KINDS[row.kind][2]: item}))
+    return favorites
+
+def get_favorite(user_id, kind, favorite_id):
+    favorite = Favorite.query.filter_by(id=favorite_id, user_id=user_id, kind=kind).first()
+    return None if favorite is None else serialize_favorite(favorite)
+
+def is_unique_violation(error):
+    message = str(error.orig).lower()
+    return 'unique' in message or 'duplicate' in message
+
+def add_favorite(user_id, kind, item_id, duplicated_msg, missing_msg):
+    # the item id can point to any of the catalog tables, so there is no foreign key to check it
+    if not isinstance(item_id, int) or entity_cache.get_serialized(FAVORITE_KINDS[kind][0], item_id) is None:
+        raise APIException(missing_msg, status_code=404)
+
+    # a single INSERT: the unique index on (user_id, kind, item_id) rejects duplicates and
+    # the foreign key rejects unknown users
+    favorite = Favorite(user_id=user_id, kind=kind, item_id=item_id)
+    db.session.add(favorite)
+    try:
+        db.session.flush()
+        update_counts(db.session.connection(), added=[(kind, item_id)])
+        serialized = serialize_favorite(favorite)
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        if is_unique_violation(error):
+            raise APIException(duplicated_msg, status_code=409)
+        raise APIException(missing_msg, status_code=404)
+    return serialized
+
+def remove_favorite(user_id, kind, favorite_id):
+    # another user's favorite is missing as far as this user can tell
+    favorite = Favorite.query.filter_by(id=favorite_id, user_id=user_id, kind=kind).first()
+    if favorite is None:
+        return None
+    serialized = serialize_favorite(favorite)
+    db.session.delete(favorite)
+    update_counts(db.session.connection(), removed=[(kind, favorite.item_id)])
+    db.session.commit()
+    return serialized
+
+
+def validate_entry(entry):
+    if not isinstance(entry, dict):
+        return "Each entry must be a json object"
+    if entry.get('kind') not in FAVORITE_KINDS:
+        return "kind must be one of " + ", ".join(FAVORITE_KINDS)
+    if entry.get('op') not in FAVORITE_OPS:
+        return "op must be one of " + ", ".join(FAVORITE_OPS)
+    if not isinstance(entry.get('item_id'), int) or isinstance(entry.get('item_id'), bool):
+        return "item_id must be a number"
+    return None
+
+def apply_favorites_batch(user_id, entries):
+    """
+    Applies the entries in order for one user inside a single transaction. The database is
+    read with one IN query per item table and one over the favorites, whatever the size of
+    the batch, and written with at most one INSERT and one DELETE.
+    """
+    if not isinstance(entries, list):
+        raise APIException("You need to specify a json array of favorites", status_code=400)
+    if len(entries) > FAVORITES_BATCH_MAX:
+        raise APIException(f"You can change up to {FAVORITES_BATCH_MAX} favorites per request", status_code=413)
+
+    results = []
+    requested = dict((kind, set()) for kind in FAVORITE_KINDS)
+    for entry in entries:
+        error = validate_entry(entry)
+        results.append({"status": "error", "message": error} if error else {})
+        if error is None:
+            requested[entry['kind']].add(entry['item_id'])
+    requested = dict((kind, item_ids) for kind, item_ids in requested.items() if item_ids)
+
+    existing_items = {}
+    current = dict((kind, set()) for kind in requested)
+    for kind, item_ids in requested.items():
+        item_model = FAVORITE_KINDS[kind][0]
+        existing_items[kind] = set(id for (id,) in db.session.query(item_model.id).filter(item_model.id.in_(item_ids)))
+    if requested:
+        matches = matching(Favorite, [(kind, item_id) for kind, item_ids in requested.items() for item_id in item_ids])
+        for kind, item_id in db.session.query(Favorite.kind, Favorite.item_id).filter(Favorite.user_id == user_id, matches):
+            current[kind].add(item_id)
+
+    # replay the entries over the in-memory state, then write only the difference
+    state = dict((kind, set(ids)) for kind, ids in current.items())
+    for entry, result in zip(entries, results):
+        if result:
+            continue
+        kind, item_id = entry['kind'], entry['item_id']
+        result.update(kind=kind, item_id=item_id, op=entry['op'])
+        if entry['op'] == 'add':
+            if item_id not in existing_items[kind]:
+                result['status'] = "not_found"
+            elif item_id in state[kind]:
+                result['status'] = "already_favorite"
+            else:
+                state[kind].add(item_id)
+                result['status'] = "added"
+        else:
+            if item_id in state[kind]:
+                state[kind].remove(item_id)
+                result['status'] = "removed"
+            else:
+                result['status'] = "not_favorite"
+
+    added = [(kind, item_id) for kind in state for item_id in sorted(state[kind] - current[kind])]
+    removed = [(kind, item_id) for kind in state for item_id in sorted(current[kind] - state[kind])]
+    try:
+        if added:
+            db.session.execute(insert(Favorite).values([{"user_id": user_id, "kind": kind, "item_id": item_id} for kind, item_id in added]))
+        if removed:
+            db.session.execute(delete(Favorite).where(Favorite.user_id == user_id, matching(Favorite, removed)))
+        update_counts(db.session.connection(), added, removed)
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request added one of the same favorites
+        db.session.rollback()
+        raise APIException("Your favorites changed while applying the batch, try again", status_code=409)
+
+    return results
+
+
+def popular_items(kind, limit=POPULAR_DEFAULT_LIMIT):
+    """
+    The most favorited items of a kind with their count, read in order from the
+    (kind, count, item_id) index.
+    """
+    rows = db.session.query(FavoriteCount.item_id, FavoriteCount.count).filter(FavoriteCount.kind == kind, FavoriteCount.count > 0)
+    rows = rows.order_by(FavoriteCount.count.desc(), FavoriteCount.item_id.desc()).limit(limit).all()
+    items = entity_cache.get_many_serialized(FAVORITE_KINDS[kind][0], [row.item_id for row in rows])
+    return [dict(items[row.item_id], favorites=row.count) for row in rows if row.item_id in items]
+
+def reconcile_favorite_counts():
+    """
+    Rewrites the counts that don't match the favorite table, returns how many were fixed.
+    A write committed while this runs can leave a count off by one until the next run.
+    """
+    actual = dict(((kind, item_id), count) for kind, item_id, count in
+                  db.session.query(Favorite.kind, Favorite.item_id, func.count()).group_by(Favorite.kind, Favorite.item_id))
+    stored = dict(((counter.kind, counter.item_id), counter) for counter in FavoriteCount.query)
+
+    fixed = 0
+    for key in set(actual) | set(stored):
+        count = actual.get(key, 0)
+        counter = stored.get(key)
+        if counter is None:
+            db.session.add(FavoriteCount(kind=key[0], item_id=key[1], count=count))
+        elif count == 0:
+            db.session.delete(counter)
+        elif counter.count != count:
+            counter.count = count
+        else:
+            continue
+        fixed += 1
+    db.session.commit()
+    return fixed
+
+
+def forget_deleted_item(kind):
+    # the favorites of a deleted item go with it, like the ON DELETE CASCADE of a foreign key
+    def listener(mapper, connection, target):
+        connection.execute(delete(Favorite.__table__).where(Favorite.kind == kind, Favorite.item_id == target.id))
+        connection.execute(delete(FavoriteCount.__table__).where(FavoriteCount.kind == kind, FavoriteCount.item_id == target.id))
+    return listener
+
+for kind, (item_model, id_key, item_key) in FAVORITE_KINDS.items():
+    event.listen(item_model, 'after_delete', forget_deleted_item(kind))
+
+@event.listens_for(User, 'before_delete')
+def forget_deleted_user(mapper, connection, target):
+    # the foreign key would remove the favorites of the user, but not their counts
+    favorites = connection.execute(db.select(Favorite.kind, Favorite.item_id).where(Favorite.user_id == target.id)).all()
+    if favorites:
+        update_counts(connection, removed=[tuple(favorite) for favorite in favorites])
+        connection.execute(delete(Favorite.__table__).where(Favorite.user_id == target.id))
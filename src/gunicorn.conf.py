@@ -0,0 +1,52 @@
+"""
+Gunicorn settings. The Procfile starts gunicorn with --chdir ./src/, which is where
+gunicorn looks for this file.
+
+With preload the master process imports the app once and the workers are forked from it,
+so they share those pages copy-on-write instead of each importing everything again.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+# db_pool sizes the connection pool of each worker from the same variable
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# read by metrics.py, the workers of this master share one directory that nothing else uses
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'starwars_api_metrics_{os.getpid()}'))
+
+
+def on_starting(server):
+    # files left by an earlier run would add to the new totals
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+def on_exit(server):
+    shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
+
+def when_ready(server):
+    # the objects the master loaded live as long as the workers, freezing them keeps the
+    # garbage collector of every worker from writing to their pages and copying them
+    if preload_app:
+        gc.freeze()
+
+def post_fork(server, worker):
+    # connections the master opened while loading the app can't be shared by the workers
+    if preload_app:
+        from wsgi import application
+        from models import db
+        with application.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+def worker_exit(server, worker):
+    # what the worker counted since its last flush
+    from metrics import metrics
+    if metrics.counters or metrics.histograms:
+        metrics.flush(force=True)
+
+def child_exit(server, worker):
+    from metrics import retire_worker
+    retire_worker(worker.pid, os.environ['METRICS_DIR'])
@@ -0,0 +1,39 @@
+"""
+JSON provider that encodes responses with orjson when it's installed and falls back to
+Flask's stdlib provider otherwise. The bytes sent are the same in both cases: anything
+orjson would write differently (non-ASCII text, pretty printing in debug) goes through
+the stdlib encoder. Floats in exponent notation are the one exception, orjson writes
+1e16 where the stdlib writes 1e+16; the models have no float columns.
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def fast_dumps(self, obj):
+        # dates, decimals, etc. are passed to Flask's default() so they keep Flask's format
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        try:
+            body = orjson.dumps(obj, default=self.default, option=options)
+        except (orjson.JSONEncodeError, TypeError):
+            return None
+        # the stdlib escapes non-ASCII characters (ensure_ascii), orjson writes them as UTF-8
+        if self.ensure_ascii and not body.isascii():
+            return None
+        return body
+
+    def response(self, *args, **kwargs):
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if orjson is None or pretty:
+            return DefaultJSONProvider.response(self, *args, **kwargs)
+
+        body = self.fast_dumps(self._prepare_response_obj(args, kwargs))
+        if body is None:
+            return DefaultJSONProvider.response(self, *args, **kwargs)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
@@ -4,48 +4,94 @@ This module takes care of starting the API Server, Loading the DB and Adding the
 import os
 from hmac import compare_digest
 
-from flask import Flask, request, jsonify, url_for, request
-from flask_migrate import Migrate
-from flask_swagger import swagger
+from flask import Flask, Blueprint, request, jsonify, current_app
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
-from models import db, User, Planets, Character, Vehicles, FavoriteVehicles, FavoriteCharacter, FavoritePlanets, Favorites
+from utils import APIException, generate_sitemap, paginate, add_pagination_headers, wants_stream, stream_response, requested_fields, select_rows, serialize_rows, pick_fields, apply_filters, requested_ids
+from cache import cached_response, entity_cache, current_user_id, response_cache, identity_cache
+from bulk import bulk_create
+from favorites import apply_favorites_batch, user_favorites, get_favorite, add_favorite, remove_favorite, popular_items, reconcile_favorite_counts, POPULAR_DEFAULT_LIMIT, POPULAR_MAX_LIMIT
+from passwords import passwords
+from search import search, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from db_pool import engine_options, enforce_foreign_keys, pool_stats
+from replicas import replica_binds, setup_replicas
+from json_provider import FastJSONProvider
+from metrics import setup_metrics
+from query_inspector import setup_query_inspector
+from compression import setup_compression
+from models import db, User, Planets, Character, Vehicles
 #from models import Person
 
 from flask_jwt_extended import create_access_token
 from flask_jwt_extended import get_jwt_identity
 from flask_jwt_extended import jwt_required
 from flask_jwt_extended import JWTManager
-from flask_sqlalchemy import SQLAlchemy
 
-from flask_bcrypt import Bcrypt
 
-app = Flask(__name__, template_folder='./templates')
-app.url_map.strict_slashes = False
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DB_CONNECTION_STRING')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
-
-app.config['JWT_SECRET_KEY'] = '4geeks' 
-jwt = JWTManager(app)
-bcrypt=Bcrypt(app)
+def env_flag(name, default=True):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes')
+
+DEFAULT_CONFIG = {
+    "SQLALCHEMY_DATABASE_URI": os.environ.get('DB_CONNECTION_STRING'),
+    "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    "SQLALCHEMY_BINDS": replica_binds(),
+    "JWT_SECRET_KEY": '4geeks',
+    # the optional parts of the app, their modules are only imported when they are enabled
+    "ADMIN_ENABLED": env_flag('ADMIN_ENABLED'),
+    "MIGRATE_ENABLED": env_flag('MIGRATE_ENABLED'),
+    "METRICS_ENABLED": env_flag('METRICS_ENABLED'),
+    "COMPRESSION_ENABLED": env_flag('COMPRESSION_ENABLED'),
+}
+
+api = Blueprint('api', __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """
+    Builds the app from DEFAULT_CONFIG updated with config. Flask's CLI finds it by itself,
+    wsgi.py builds the app gunicorn serves.
+    """
+    app = Flask(__name__, template_folder='./templates')
+    app.json = FastJSONProvider(app)
+    app.url_map.strict_slashes = False
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            enforce_foreign_keys(engine)
+    setup_replicas(app)
+    CORS(app)
+    JWTManager(app)
+    if app.config['MIGRATE_ENABLED']:
+        # alembic is only needed by `flask db`, it's the heaviest import of the app
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    if app.config['ADMIN_ENABLED']:
+        from admin import setup_admin
+        setup_admin(app)
+    if app.config['METRICS_ENABLED']:
+        setup_metrics(app)
+    setup_query_inspector(app)
+    if app.config['COMPRESSION_ENABLED']:
+        setup_compression(app)
+
+    app.register_blueprint(api)
+    return app
 
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
 
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def login():
     email = request.json.get('email', None)
     password = request.json.get('password', None)
@@ -56,15 +102,35 @@ def login():
     if password is None:
         raise APIException("Tienes que enviar la constrasena", status_code=404)
 
-    is_correct = bcrypt.check_password_hash(user.password, password)
+    is_correct = passwords.check_password_hash(user.password, password)
     if not is_correct:
         return jsonify({"msg": "Bad username or password"}), 401
 
+    # the configured cost changed since this hash was made, we have the password now so upgrade it
+    if passwords.needs_rehash(user.password):
+        user.password = passwords.generate_password_hash(password)
+        db.session.commit()
+
     access_token= create_access_token(identity=email)
     return jsonify(access_token=access_token), 200
 
 
-@app.route("/protected", methods=["GET"])
+@api.route('/stats/pool', methods=['GET'])
+def get_pool_stats():
+    return jsonify(pool_stats(db.engine)), 200
+
+@api.route('/stats/cache', methods=['GET'])
+def get_cache_stats():
+    # like the pool, every worker has its own caches and answers with its own numbers
+    response_body = {
+        "entity": entity_cache.stats(),
+        "response": response_cache.stats(),
+        "identity": identity_cache.stats()
+    }
+
+    return jsonify(response_body), 200
+
+@api.route("/protected", methods=["GET"])
 @jwt_required()
 def protected():
     # Access the identity of the current user with get_jwt_identity
@@ -72,37 +138,76 @@ def protected():
     return jsonify(logged_in_as=current_user), 200
 
 
+@api.route('/search', methods=['GET'])
+def get_search():
+    q = request.args.get('q', '').strip()
+    if not q:
+        raise APIException("Tienes que enviar el texto a buscar en ?q=", status_code=400)
+
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        raise APIException("limit must be a number", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+
+    response_body = {
+        "results": search(q, limit)
+    }
+
+    return jsonify(response_body), 200
+
+
+def get_by_ids(model, key, ids):
+    # ?ids=1,5,9 on a list endpoint: the rows in the order they were asked plus the ids that don't exist
+    fields = requested_fields(model)
+    found = entity_cache.get_many_serialized(model, ids)
+
+    response_body = {
+        key: [pick_fields(found[id], fields) for id in ids if id in found],
+        "missing": [id for id in ids if id not in found]
+    }
+
+    return jsonify(response_body), 200
+
+
 ##----------------------------------USER CRUD-------------------------------------------------
 
 
 
 
 
-@app.route("/user", methods=['GET'])
+@api.route("/user", methods=['GET'])
 def handle_all_users():
-    
-    AllUser = User.query.all()
-    allUser_serialize = list(map(lambda x:x.serialize(), AllUser ))
+    ids = requested_ids()
+    if ids is not None:
+        return get_by_ids(User, "user", ids)
+    fields = requested_fields(User)
+    if wants_stream():
+        return stream_response(User.query, User, fields=fields)
 
-    return jsonify(allUser_serialize), 200
+    AllUser, next_cursor = paginate(select_rows(User.query, User, fields), User)
+    allUser_serialize = serialize_rows(AllUser, User, fields)
 
-@app.route('/user/<int:user_id>', methods=['GET'])
+    return add_pagination_headers(jsonify(allUser_serialize), next_cursor), 200
+
+@api.route('/user/<int:user_id>', methods=['GET'])
 def handle_hello(user_id):
     if user_id == 0:
         raise APIException("No existe el usuario 0", status_code=500)
-    user = User.query.get(user_id)
+    user = entity_cache.get_serialized(User, user_id)
 
     if user is None:
         raise APIException('El usuario con ese ID no existe', status_code=400)
 
     response_body = {
         "msg": "Hello, this is your GET /user response, test message ",
-        "usuarios": user.serialize()
+        "usuarios": pick_fields(user, requested_fields(User))
     }
 
     return jsonify(response_body), 200
 
-@app.route('/user', methods=['POST'])
+@api.route('/user', methods=['POST'])
 def post_new_user():
     body = request.get_json()
 
@@ -128,18 +233,18 @@ def post_new_user():
     if userUsername !=None:
         raise APIException("Este usuario ya ha sido registrado anteriormente", status_code=404)
 
-    pw_hash = bcrypt.generate_password_hash(body['password'])
+    pw_hash = passwords.generate_password_hash(body['password'])
     new_user = User(email=body['email'], username=body['username'], password=pw_hash, is_active=True)
 
     db.session.add(new_user)
     db.session.commit()
     response_body = {
-        "msg": f"El usuario {new_user.serialize()['username']} ha sido creado."
+        "msg": f"El usuario {new_user.username} ha sido creado."
     }
 
     return jsonify(response_body), 200
 
-@app.route('/user/<int:user_id>', methods=['PUT'])
+@api.route('/user/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     body = request.get_json()
 
@@ -154,7 +259,7 @@ def update_user(user_id):
     if "lastname" in body:
         updateUser.lastname = body["lastname"]
     if "password" in body:
-        updateUser.password = body["password"]
+        updateUser.password = passwords.generate_password_hash(body["password"])
     db.session.commit()
 
     response_body = {
@@ -164,7 +269,7 @@ def update_user(user_id):
 
     return jsonify(response_body), 200
 
-@app.route('/user/<int:user_id>', methods=['DELETE'])
+@api.route('/user/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
 
     delUser = User.query.get(user_id)
@@ -190,18 +295,29 @@ def delete_user(user_id):
 
 
 
-@app.route("/planets", methods=['GET'])
+@api.route("/planets", methods=['GET'])
+@cached_response('planets')
 def get_all_planets():
-    all_planets = Planets.query.all()
-    all_planets_serialized = list(map(lambda x:x.serialize(), all_planets))
+    ids = requested_ids()
+    if ids is not None:
+        return get_by_ids(Planets, "planets", ids)
+    fields = requested_fields(Planets)
+    query = apply_filters(Planets.query, Planets)
+    if wants_stream():
+        return stream_response(query, Planets, "planets", fields)
+
+    all_planets, next_cursor = paginate(select_rows(query, Planets, fields), Planets)
+    all_planets_serialized = serialize_rows(all_planets, Planets, fields)
 
     response_body = {
-        "planets": all_planets_serialized
+        "planets": all_planets_serialized,
+        "next": next_cursor
     }
 
-    return jsonify(response_body), 200
+    return add_pagination_headers(jsonify(response_body), next_cursor), 200
 
-@app.route("/planets/<int:planets_id>", methods=['GET'])
+@api.route("/planets/<int:planets_id>", methods=['GET'])
+@cached_response('planets')
 def handle_planet_id(planets_id):
 
     if planets_id < 1:
@@ -210,15 +326,18 @@ def handle_planet_id(planets_id):
     if planets_id == None:
         raise APIException("There is no planet to show", status_code=404)
 
-    planet = Planets.query.get(planets_id)
+    planet = entity_cache.get_serialized(Planets, planets_id)
+
+    if planet is None:
+        raise APIException("Planet doesn't exist", status_code=404)
 
     response_body = {
-        "result": planet.serialize()
+        "result": pick_fields(planet, requested_fields(Planets))
     }
 
     return jsonify(response_body), 200
 
-@app.route('/planets', methods=['POST'])
+@api.route('/planets', methods=['POST'])
 def post_new_planet():
     body = request.get_json()
     planet = Planets.query.get(planets_id)
@@ -239,7 +358,14 @@ def post_new_planet():
     return jsonify(response_body), 200
 
 
-@app.route("/planets/<int:planets_id>", methods=['PUT'])
+@api.route('/planets/bulk', methods=['POST'])
+def post_bulk_planets():
+    response_body = bulk_create(Planets)
+
+    return jsonify(response_body), 200
+
+
+@api.route("/planets/<int:planets_id>", methods=['PUT'])
 def update_planet(planets_id):
     body = request.get_json()
 
@@ -258,7 +384,7 @@ def update_planet(planets_id):
         "updateMsg": "Planet Updated."
     }
 
-@app.route("/planets/<int:planets_id>", methods=['DELETE'])
+@api.route("/planets/<int:planets_id>", methods=['DELETE'])
 def delete_planet_id(planets_id):
 
     planet = Planets.query.get(planets_id)
@@ -281,19 +407,30 @@ def delete_planet_id(planets_id):
 
 
 
-@app.route("/character", methods=['GET'])
+@api.route("/character", methods=['GET'])
+@cached_response('character')
 def get_all_character():
-    all_character = Character.query.all()
-    all_character_serialized = list(map(lambda x:x.serialize(), all_character))
+    ids = requested_ids()
+    if ids is not None:
+        return get_by_ids(Character, "character", ids)
+    fields = requested_fields(Character)
+    query = apply_filters(Character.query, Character)
+    if wants_stream():
+        return stream_response(query, Character, "character", fields)
+
+    all_character, next_cursor = paginate(select_rows(query, Character, fields), Character)
+    all_character_serialized = serialize_rows(all_character, Character, fields)
 
     response_body = {
-        "character": all_character_serialized
+        "character": all_character_serialized,
+        "next": next_cursor
     }
 
-    return jsonify(response_body), 200
+    return add_pagination_headers(jsonify(response_body), next_cursor), 200
 
 
-@app.route("/character/<int:character_id>", methods=['GET'])
+@api.route("/character/<int:character_id>", methods=['GET'])
+@cached_response('character')
 def handle_character_id(character_id):
 
     if character_id < 1:
@@ -302,15 +439,18 @@ def handle_character_id(character_id):
     if character_id == None:
         raise APIException("There is no character to show", status_code=404)
 
-    character = Character.query.get(character_id)
+    character = entity_cache.get_serialized(Character, character_id)
+
+    if character is None:
+        raise APIException("Character doesn't exist", status_code=404)
 
     response_body = {
-        "result": character.serialize()
+        "result": pick_fields(character, requested_fields(Character))
     }
 
     return jsonify(response_body), 200
 
-@app.route('/character', methods=['POST'])
+@api.route('/character', methods=['POST'])
 def post_new_character():
     body = request.get_json()
     character = Character.query.get(character_id)
@@ -338,7 +478,14 @@ def post_new_character():
     return jsonify(response_body), 200
 
 
-@app.route("/character/<int:characters_id>", methods=['PUT'])
+@api.route('/character/bulk', methods=['POST'])
+def post_bulk_character():
+    response_body = bulk_create(Character)
+
+    return jsonify(response_body), 200
+
+
+@api.route("/character/<int:characters_id>", methods=['PUT'])
 def update_character(character_id):
     body = request.get_json()
 
@@ -361,7 +508,7 @@ def update_character(character_id):
         "updateMsg": "Character Updated."
     }
 
-@app.route("/characters/<int:characters_id>", methods=['DELETE'])
+@api.route("/characters/<int:characters_id>", methods=['DELETE'])
 def delete_character_id(character_id):
 
     character = Character.query.get(character_id)
@@ -388,18 +535,29 @@ def delete_character_id(character_id):
 
 
 
-@app.route("/vehicles", methods=['GET'])
+@api.route("/vehicles", methods=['GET'])
+@cached_response('vehicles')
 def get_all_vehicles():
-    all_vehicles = Vehicles.query.all()
-    all_vehicles_serialized = list(map(lambda x:x.serialize(), all_vehicles))
+    ids = requested_ids()
+    if ids is not None:
+        return get_by_ids(Vehicles, "vehicles", ids)
+    fields = requested_fields(Vehicles)
+    query = apply_filters(Vehicles.query, Vehicles)
+    if wants_stream():
+        return stream_response(query, Vehicles, "vehicles", fields)
+
+    all_vehicles, next_cursor = paginate(select_rows(query, Vehicles, fields), Vehicles)
+    all_vehicles_serialized = serialize_rows(all_vehicles, Vehicles, fields)
 
     response_body = {
-        "vehicles": all_vehicles_serialized
+        "vehicles": all_vehicles_serialized,
+        "next": next_cursor
     }
 
-    return jsonify(response_body), 200
+    return add_pagination_headers(jsonify(response_body), next_cursor), 200
 
-@app.route("/vehicles/<int:vehicles_id>", methods=['GET'])
+@api.route("/vehicles/<int:vehicles_id>", methods=['GET'])
+@cached_response('vehicles')
 def handle_vehicles_id(vehicles_id):
 
     if vehicles_id < 1:
@@ -408,15 +566,18 @@ def handle_vehicles_id(vehicles_id):
     if vehicles_id == None:
         raise APIException("There are no vehicles to show", status_code=404)
 
-    vehicles = Vehicles.query.get(vehicles_id)
+    vehicles = entity_cache.get_serialized(Vehicles, vehicles_id)
+
+    if vehicles is None:
+        raise APIException("Vehicle doesn't exist", status_code=404)
 
     response_body = {
-        "result": vehicles.serialize()
+        "result": pick_fields(vehicles, requested_fields(Vehicles))
     }
 
     return jsonify(response_body), 200
 
-@app.route('/vehicles', methods=['POST'])
+@api.route('/vehicles', methods=['POST'])
 def post_new_vehicle():
     body = request.get_json()
     vehicle = Character.query.get(vehicle_id)
@@ -442,7 +603,14 @@ def post_new_vehicle():
     return jsonify(response_body), 200
 
 
-@app.route("/vehicles/<int:vehicles_id>", methods=['PUT'])
+@api.route('/vehicles/bulk', methods=['POST'])
+def post_bulk_vehicles():
+    response_body = bulk_create(Vehicles)
+
+    return jsonify(response_body), 200
+
+
+@api.route("/vehicles/<int:vehicles_id>", methods=['PUT'])
 def update_vehicle(vehicles_id):
     body = request.get_json()
 
@@ -463,7 +631,7 @@ def update_vehicle(vehicles_id):
 
     return jsonify(response_body), 200
 
-@app.route("/vehicles/<int:vehicles_id>", methods=['DELETE'])
+@api.route("/vehicles/<int:vehicles_id>", methods=['DELETE'])
 def delete_vehicles_id(vehicles_id):
 
     vehicle = Vehicles.query.get(vehicles_id)
@@ -487,15 +655,10 @@ def delete_vehicles_id(vehicles_id):
 
 
 
-
-
-
-
-@app.route("/favoritecharacter", methods=['GET'])
+@api.route("/favoritecharacter", methods=['GET'])
 @jwt_required()
 def get_all_favcharacters():
-    all_favchar = FavoriteCharacter.query.all()
-    all_favchar_serialized = list(map(lambda x:x.serialize(), all_favchar))
+    all_favchar_serialized = user_favorites(current_user_id(), "character")["character"]
 
     response_body = {
         "favoritecharacters": all_favchar_serialized
@@ -503,69 +666,54 @@ def get_all_favcharacters():
 
     return jsonify(response_body), 200
 
-@app.route("/favoritecharacter/<int:favoritecharacter_id>", methods=['GET'])
+@api.route("/favoritecharacter/<int:favoritecharacter_id>", methods=['GET'])
 @jwt_required()
 def handle_favchar_id(favoritecharacter_id):
 
     if favoritecharacter_id < 1:
         raise APIException("This character does not exist on your favorites", status_code=404)
 
-    if favoritecharacter_id == None:
-        raise APIException("There is no favorite character to show", status_code=404)
+    favchar = get_favorite(current_user_id(), "character", favoritecharacter_id)
 
-    favchar = FavoriteCharacter.query.get()
+    if favchar is None:
+        raise APIException("This character does not exist on your favorites", status_code=404)
 
     response_body = {
-        "result": favchar.serialize()
+        "result": favchar
     }
 
     return jsonify(response_body), 200
 
-@app.route("/users/favorites/character", methods=['POST'])
+@api.route("/users/favorites/character", methods=['POST'])
+@jwt_required()
 def post_favoritecharacter():
     body = request.get_json()
     
     if body is None:
         raise APIException("You need to specify the request body as a json object", status_code=400)
 
-    postUserId = User.query.get(body['user_id'])
-    if postUserId == None:
-        raise APIException("This character does not exist...yet", status_code=404)
-
-    registerExist = FavoriteCharacter.query.filter_by(character_id = body['character_id']).filter_by(user_id = body['user_id']).all()
-
-    if len(registerExist) > 0:
-        raise APIException("This character already has this favorite character.", status_code=404)
-
-    postCharacterId = Character.query.get(body['character_id'])
-    if postCharacterId == None:
-        raise APIException("This character is not on the list...yet", status_code=404)
-
-    postfavcharacter = FavoriteCharacter(character_id = body['character_id'], user_id = body['user_id'])
-    db.session.add(postfavcharacter)
-    db.session.commit()
-
     response_body = {
-        "message": postfavcharacter.serialize()
+        "message": add_favorite(current_user_id(), "character", body.get('character_id'), "This user already has this favorite character.", "This user or character does not exist...yet")
     }
 
     return jsonify(response_body), 200
 
 
-@app.route("/favoritecharacter/<int:favoritecharacter_id>", methods=['DELETE'])
+@api.route("/favoritecharacter/<int:favoritecharacter_id>", methods=['DELETE'])
+@jwt_required()
 def delete_favchar_id(favoritecharacter_id):
 
-    favcharacters = FavoriteCharacter.query.get(favoritecharacter_id)
+    favcharacters = remove_favorite(current_user_id(), "character", favoritecharacter_id)
 
-    db.session.delete(favcharacters)
-    db.session.commit()
+    if favcharacters is None:
+        raise APIException("This character does not exist on your favorites", status_code=404)
 
     response_body = {
         "message": "Ok",
         "deletedFavCharacter": "Favorite character deleted"
     }
 
-    return jsonify(favcharacters), 200
+    return jsonify(response_body), 200
 
 
 
@@ -580,11 +728,10 @@ def delete_favchar_id(favoritecharacter_id):
 
 
 
-@app.route("/favoritevehicles", methods=['GET'])
+@api.route("/favoritevehicles", methods=['GET'])
 @jwt_required()
 def get_all_favvehicles():
-    all_favveh = FavoriteVehicles.query.all()
-    all_favveh_serialized = list(map(lambda x:x.serialize(), all_favveh))
+    all_favveh_serialized = user_favorites(current_user_id(), "vehicle")["vehicle"]
 
     response_body = {
         "favoritevehicles": all_favveh_serialized
@@ -593,70 +740,55 @@ def get_all_favvehicles():
     return jsonify(response_body), 200
 
 
-@app.route("/favoritevehicles/<int:favoritevehicles_id>", methods=['GET'])
+@api.route("/favoritevehicles/<int:favoritevehicles_id>", methods=['GET'])
 @jwt_required()
 def handle_favvehicles_id(favoritevehicles_id):
 
     if favoritevehicles_id < 1:
         raise APIException("This vehicle does not exist on your favorites", status_code=404)
 
-    if favoritevehicles_id == None:
-        raise APIException("There is no favorite vehicle to show", status_code=404)
+    favveh = get_favorite(current_user_id(), "vehicle", favoritevehicles_id)
 
-    favveh = FavoriteVehicles.query.get()
+    if favveh is None:
+        raise APIException("This vehicle does not exist on your favorites", status_code=404)
 
     response_body = {
-        "result": favveh.serialize()
+        "result": favveh
     }
 
     return jsonify(response_body), 200
 
-@app.route("/users/favorites/vehicle", methods=['POST'])
+@api.route("/users/favorites/vehicle", methods=['POST'])
+@jwt_required()
 def post_favoriteVehicle():
     body = request.get_json()
     
     if body is None:
         raise APIException("You need to specify the request body as a json object", status_code=400)
 
-    postUserId = User.query.get(body['user_id'])
-    if postUserId == None:
-        raise APIException("This user does not exist...yet", status_code=404)
-
-    registerExist = FavoriteVehicles.query.filter_by(vehicles_id = body['vehicles_id']).filter_by(user_id = body['user_id']).all()
-
-    if len(registerExist) > 0:
-        raise APIException("This user already has this favorite vehicle.", status_code=404)
-
-    postVehicle = Vehicles.query.get(body['vehicles_id'])
-    if postPlanets == None:
-        raise APIException("This vehicle is not on the list...yet", status_code=404)
-
-    postfavvehicle = FavoriteVehicles(vehicles_id = body['vehicles_id'], user_id = body['user_id'])
-    db.session.add(postfavvehicle)
-    db.session.commit()
-
     response_body = {
-        "message": postfavvehicle.serialize()
+        "message": add_favorite(current_user_id(), "vehicle", body.get('vehicles_id'), "This user already has this favorite vehicle.", "This user or vehicle does not exist...yet")
     }
 
     return jsonify(response_body), 200
 
 
 
-@app.route("/favoritevehicles/<int:favoritevehicles_id>", methods=['DELETE'])
+@api.route("/favoritevehicles/<int:favoritevehicles_id>", methods=['DELETE'])
+@jwt_required()
 def delete_favvehicles_id(favoritevehicles_id):
 
-    favvehicle = FavoriteVehicles.query.get(favoritevehicles_id)
+    favvehicle = remove_favorite(current_user_id(), "vehicle", favoritevehicles_id)
 
-    db.session.delete(favvehicle)
-    db.session.commit()
+    if favvehicle is None:
+        raise APIException("This vehicle does not exist on your favorites", status_code=404)
 
     response_body = {
         "message": "Ok",
         "deletedFavVehicle": "Favorite vehicle deleted"
     }
 
-    return jsonify(favvehicle), 200
+    return jsonify(response_body), 200
 
 
 
@@ -672,11 +804,10 @@ def delete_favvehicles_id(favoritevehicles_id):
 
 
 
-@app.route("/favoriteplanets", methods=['GET'])
+@api.route("/favoriteplanets", methods=['GET'])
 @jwt_required()
 def get_all_favplanets():
-    all_favplan = FavoritePlanets.query.all()
-    all_favplan_serialized = list(map(lambda x:x.serialize(), all_favplan))
+    all_favplan_serialized = user_favorites(current_user_id(), "planet")["planet"]
 
     response_body = {
         "favoriteplanets": all_favplan_serialized
@@ -684,68 +815,53 @@ def get_all_favplanets():
 
     return jsonify(response_body), 200
 
-@app.route("/favoriteplanets/<int:favoriteplanets_id>", methods=['GET'])
+@api.route("/favoriteplanets/<int:favoriteplanets_id>", methods=['GET'])
 @jwt_required()
 def handle_favplanets_id(favoriteplanets_id):
     if favoriteplanets_id <1:
         raise APIException("This planet doesn't not exist on your favorites.", status_code = 404)
 
-    if favoriteplanets_id == None:
-        raise APIException("There is no favorite vehicle to show", status_code = 404)
+    favplan = get_favorite(current_user_id(), "planet", favoriteplanets_id)
 
-    favplan = FavoritePlanets.query.get()
+    if favplan is None:
+        raise APIException("This planet doesn't not exist on your favorites.", status_code = 404)
 
     response_body = {
-        "result": favplan.serialize()
+        "result": favplan
     }
 
     return jsonify(response_body), 200
 
-@app.route("/users/favorites/planets", methods=['POST'])
+@api.route("/users/favorites/planets", methods=['POST'])
+@jwt_required()
 def post_favoritePlanets():
     body = request.get_json()
 
     if body is None:
         raise APIException("You need to specify the request body as a json object", status_code=400)
     
-    postUserId = User.query.get(body['user_id'])
-    if postUserId == None:
-        raise APIException("This user does not exist...yet", status_code=404)
-
-    registerExist = FavoritePlanets.query.filter_by(planets_id = body['planets_id']).filter_by(user_id = body['user_id']).all()
-
-    if len(registerExist) > 0:
-        raise APIException("This planet already has this favorite planets.", status_code=404)
-
-    postPlanets = Planets.query.get(body['planets_id'])
-    if postPlanets == None:
-        raise APIException("This planet is not on the list...yet", status_code=404)
-
-    postfavplanets = FavoritePlanets(planets_id = body['planets_id'], user_id = body['user_id'])
-    db.session.add(postfavplanets)
-    db.session.commit()
-
     response_body = {
-        "message": postfavplanets.serialize()
+        "message": add_favorite(current_user_id(), "planet", body.get('planets_id'), "This user already has this favorite planet.", "This user or planet does not exist...yet")
     }
 
     return jsonify(response_body), 200
 
 
-@app.route("/favoriteplanets/<int:favoriteplanets_id>", methods=['DELETE'])
+@api.route("/favoriteplanets/<int:favoriteplanets_id>", methods=['DELETE'])
+@jwt_required()
 def delete_favplanets_id(favoriteplanets_id):
 
-    favplanets = FavoritePlanets.query.get(favoriteplanets_id)
-    
-    db.session.delete(favplanets)
-    db.session.commit()
+    favplanets = remove_favorite(current_user_id(), "planet", favoriteplanets_id)
+
+    if favplanets is None:
+        raise APIException("This planet doesn't not exist on your favorites.", status_code = 404)
 
     response_body = {
         "message": "Ok",
         "deletedFavCharacter": "Favorite planet deleted"
     }
 
-    return jsonify(favplanets), 200
+    return jsonify(response_body), 200
 
 
 
@@ -757,14 +873,63 @@ def delete_favplanets_id(favoriteplanets_id):
 
 
 
-@app.route("/users/favorites", methods=['GET'])
+@api.route("/users/favorites", methods=['GET'])
 @jwt_required()
 def get_favorites():
-    all_favorites = Favorites.query.all()
-    all_favorites_serialized = list(map(lambda x:x.serialize(), all_favorites))
+    # every kind in one range scan over the favorites index
+    favorites = user_favorites(current_user_id())
+
+    response_body = {
+        "favorites": {
+            "character": favorites["character"],
+            "vehicles": favorites["vehicle"],
+            "planets": favorites["planet"]
+        }
+    }
+
+    return jsonify(response_body), 200
+
+def get_popular(kind, key):
+    try:
+        limit = min(int(request.args.get('limit', POPULAR_DEFAULT_LIMIT)), POPULAR_MAX_LIMIT)
+    except ValueError:
+        raise APIException("limit must be a number", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+
+    response_body = {
+        key: popular_items(kind, limit)
+    }
+
+    return jsonify(response_body), 200
+
+@api.route("/planets/popular", methods=['GET'])
+def get_popular_planets():
+    return get_popular("planet", "planets")
+
+@api.route("/character/popular", methods=['GET'])
+def get_popular_character():
+    return get_popular("character", "character")
+
+@api.route("/vehicles/popular", methods=['GET'])
+def get_popular_vehicles():
+    return get_popular("vehicle", "vehicles")
+
+@api.cli.command("reconcile-favorite-counts")
+def reconcile_favorite_counts_command():
+    """Fixes the favorite counts that drifted from the favorite table."""
+    print(f"{reconcile_favorite_counts()} favorite counts fixed")
+
+@api.route("/users/favorites/batch", methods=['POST'])
+@jwt_required()
+def post_favorites_batch():
+    body = request.get_json()
+
+    if body is None:
+        raise APIException("You need to specify the request body as a json array", status_code=400)
 
     response_body = {
-        "favorites": all_favorites_serialized
+        "results": apply_favorites_batch(current_user_id(), body)
     }
 
     return jsonify(response_body), 200
@@ -774,5 +939,5 @@ def get_favorites():
 # this only runs if `$ python src/main.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
 
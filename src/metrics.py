@@ -0,0 +1,235 @@
+"""
+Request and database metrics in the Prometheus text format.
+
+Every gunicorn worker keeps its own metrics in memory and regularly dumps them to its own
+file inside METRICS_DIR. /metrics adds up the files of all the workers, so it doesn't
+matter which worker answers the scrape. When a worker exits the gunicorn master adds its
+file to the dead workers' total (gunicorn.conf.py), and clears the directory on start.
+METRICS_DIR defaults to a directory of this server only, so other servers on the host and
+earlier runs don't add to its totals.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import g, request, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'starwars_api_metrics_{os.getpid()}'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+DEAD_WORKERS_FILE = "dead_workers.json"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+HELP = {
+    "http_requests_total": ("counter", "Requests by endpoint, method and status code"),
+    "http_request_duration_seconds": ("histogram", "Time to build the response"),
+    "http_response_size_bytes": ("histogram", "Size of the response body"),
+    "db_queries_per_request": ("histogram", "SQL statements executed by one request"),
+    "db_time_per_request_seconds": ("histogram", "Time spent in SQL statements by one request"),
+}
+
+
+class Metrics:
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = 0.0
+        self._pid = None
+        self._token = None
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, dict(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, dict(labels), dict(h, counts=list(h["counts"]))] for (name, labels), h in self.histograms.items()]
+            }
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        with self._flush_lock:
+            self._last_flush = now
+            os.makedirs(self.directory, exist_ok=True)
+            write_snapshot(os.path.join(self.directory, self._filename()), self.snapshot())
+
+    def _filename(self):
+        # a new worker can get the pid of a dead one, the token keeps their files apart
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._token = uuid.uuid4().hex[:8]
+        return f"{self._pid}-{self._token}.json"
+
+    def collect(self):
+        """
+        Sum of the snapshots of the live workers and of the dead workers' total.
+        """
+        self.flush(force=True)
+        dead = read_snapshot(os.path.join(self.directory, DEAD_WORKERS_FILE)) or {}
+        merged = set(dead.get("merged", ()))
+        snapshots = [dead]
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json") and filename != DEAD_WORKERS_FILE and filename not in merged:
+                snapshots.append(read_snapshot(os.path.join(self.directory, filename)))
+        return add_snapshots(snapshots)
+
+    def render(self):
+        counters, histograms = self.collect()
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described and name in HELP:
+                kind, text = HELP[name]
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), h in sorted(histograms.items()):
+            describe(name)
+            for bound, count in zip(h["buckets"], h["counts"]):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', repr(float(bound))),))} {count}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {h['count']}")
+            lines.append(f"{name}_sum{format_labels(labels)} {h['sum']}")
+            lines.append(f"{name}_count{format_labels(labels)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_snapshot(path, snapshot):
+    with open(path + ".tmp", "w") as file:
+        json.dump(snapshot, file)
+    os.replace(path + ".tmp", path)
+
+def add_snapshots(snapshots):
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        if snapshot is None:
+            continue
+        for name, labels, value in snapshot.get("counters", ()):
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, h in snapshot.get("histograms", ()):
+            key = (name, tuple(sorted(labels.items())))
+            total = histograms.setdefault(key, {"buckets": h["buckets"], "counts": [0] * len(h["buckets"]), "sum": 0.0, "count": 0})
+            total["counts"] = [a + b for a, b in zip(total["counts"], h["counts"])]
+            total["sum"] += h["sum"]
+            total["count"] += h["count"]
+    return counters, histograms
+
+def retire_worker(pid, directory=METRICS_DIR):
+    """
+    Adds the file of an exited worker to the dead workers' total, so its counts stay in
+    /metrics without keeping a file per worker ever started. Runs in the gunicorn master,
+    the only writer of the total.
+    """
+    try:
+        filenames = [filename for filename in os.listdir(directory) if filename.startswith(f"{pid}-") and filename.endswith(".json")]
+    except FileNotFoundError:
+        return
+    if not filenames:
+        return
+    path = os.path.join(directory, DEAD_WORKERS_FILE)
+    dead = read_snapshot(path) or {}
+    counters, histograms = add_snapshots([dead] + [read_snapshot(os.path.join(directory, filename)) for filename in filenames])
+
+    # the total lists the files it already holds, so a scrape between writing it and
+    # removing them doesn't count them twice
+    existing = set(os.listdir(directory))
+    write_snapshot(path, {
+        "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, dict(labels), h] for (name, labels), h in histograms.items()],
+        "merged": [filename for filename in dead.get("merged", ()) if filename in existing] + filenames
+    })
+    for filename in filenames:
+        os.remove(os.path.join(directory, filename))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + "}"
+
+
+metrics = Metrics()
+
+
+##----------------------------------SQL timing-------------------------------------
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+        g.db_time = g.get('db_time', 0.0) + elapsed
+
+
+##----------------------------------request hooks-------------------------------------
+
+
+def setup_metrics(app):
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.db_queries = 0
+        g.db_time = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if 'request_start' not in g:
+            return response
+        endpoint = request.endpoint or "none"
+        metrics.inc("http_requests_total", {"endpoint": endpoint, "method": request.method, "status": response.status_code})
+        metrics.observe("http_request_duration_seconds", {"endpoint": endpoint}, time.perf_counter() - g.request_start, LATENCY_BUCKETS)
+        if response.content_length is not None:
+            metrics.observe("http_response_size_bytes", {"endpoint": endpoint}, response.content_length, SIZE_BUCKETS)
+        metrics.observe("db_queries_per_request", {"endpoint": endpoint}, g.db_queries, QUERY_COUNT_BUCKETS)
+        metrics.observe("db_time_per_request_seconds", {"endpoint": endpoint}, g.db_time, LATENCY_BUCKETS)
+        metrics.flush()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1,6 +1,30 @@
+import operator
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+def serializer(*fields):
+    """
+    Builds a serialize() method from the names of the fields to emit, or (key, attribute)
+    pairs when the key differs. A single attrgetter reads every attribute and the keys
+    keep their order.
+    """
+    pairs = [(field, field) if isinstance(field, str) else field for field in fields]
+    keys = tuple(key for key, attribute in pairs)
+    attributes = tuple(attribute for key, attribute in pairs)
+    get_values = operator.attrgetter(*attributes)
+
+    def serialize(self):
+        values = get_values(self)
+        return dict(zip(keys, values if len(keys) > 1 else (values,)))
+
+    serialize.fields = keys
+    serialize.attributes = attributes
+    return serialize
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,140 +38,85 @@ class User(db.Model):
     def __repr__(self):
         return f'El usuario con email: {self.email}'
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "email": self.email,
-            "is_active": self.is_active
-            # do not serialize the password, its a security breach
-        }
+    # do not serialize the password, its a security breach
+    serialize = serializer('id', 'email', 'is_active')
 
 class Planets(db.Model):
+    filterable_columns = ('population', 'diameter')
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
-    population = db.Column(db.Integer, nullable=True)
-    diameter = db.Column(db.Integer, nullable=True)
+    population = db.Column(db.Integer, nullable=True, index=True)
+    diameter = db.Column(db.Integer, nullable=True, index=True)
 
 
     def __repr__(self):
         return f"Planeta {self.name} con ID {self.id}. Su diametro es de {self.diameter} y tiene una poblacion de {self.population}. "
 
-    def serialize(self):
-        return {
-            'id' : self.id,
-            'name' : self.name,
-            'population' : self.population,
-            'diameter': self.diameter
-        }
+    serialize = serializer('id', 'name', 'population', 'diameter')
 
 class Vehicles(db.Model):
+    filterable_columns = ('cost_in_credits',)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
     model = db.Column(db.String(120), nullable=True)
-    cost_in_credits = db.Column(db.Integer, nullable=True)
+    cost_in_credits = db.Column(db.Integer, nullable=True, index=True)
 
     def __repr__(self):
         return f"{self.name} con ID {self.id} tiene un costo de {self.cost_in_credits}"
 
-    def serialize(self):
-        return {
-            'id' : self.id,
-            'name' : self.name,
-            'model' : self.model,
-            'cost_in_credits' : self.cost_in_credits
-        }
+    serialize = serializer('id', 'name', 'model', 'cost_in_credits')
 
 class Character(db.Model):
+    filterable_columns = ('height', 'birth_year')
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
     last_name = db.Column(db.String(120), unique=False, nullable=False)
-    height = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True, index=True)
     hair_color = db.Column(db.String(120), nullable=True)
-    birth_year = db.Column(db.Integer, nullable=True)
+    birth_year = db.Column(db.Integer, nullable=True, index=True)
 
     def __repr__(self):
         return f"{self.name} {self.last_name} con ID {self.id}"
 
-    def serialize(self):
-        return {
-            'id' : self.id,
-            'name' : self.name,
-            'last_name' : self.last_name,
-            'hair_color' : self.hair_color,
-            'birth_year' : self.birth_year
-        }
-
-class FavoriteCharacter(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id', ondelete='CASCADE'))
-    character = db.relationship(Character, primaryjoin=character_id == Character.id)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
-    User = db.relationship('User', primaryjoin=user_id == User.id)
-
-    def __repr__(self):
-        return '<FavoriteCharacter %r' % self.id
-
-    def serialize(self):
-        return {
-            'id': self.id,
-            'character_id': self.character_id,
-            'user_id': self.user_id 
-        }
-
-class FavoriteVehicles(db.Model):
+    serialize = serializer('id', 'name', 'last_name', 'hair_color', 'birth_year')
+
+class Favorite(db.Model):
+    """
+    Every favorite of every user, the item is a character, a vehicle or a planet depending
+    on the kind. The (user_id, kind, created_at, item_id) index holds all the columns the
+    favorites endpoints read (the primary key comes with every index entry), so the
+    favorites of a user are one range scan over the index that never reads the table.
+    """
+    __table_args__ = (
+        db.Index('ix_favorite_user_id_kind_item_id', 'user_id', 'kind', 'item_id', unique=True),
+        db.Index('ix_favorite_user_id_kind_created_at_item_id', 'user_id', 'kind', 'created_at', 'item_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    vehicles_id = db.Column(db.Integer, db.ForeignKey('vehicles.id', ondelete='CASCADE'))
-    vehicles = db.relationship(Vehicles, primaryjoin=vehicles_id == Vehicles.id)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     User = db.relationship('User', primaryjoin=user_id == User.id)
+    kind = db.Column(db.String(20), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
-        return '<FavoriteVehicle %r' % self.id
-
-    def serialize(self):
-        return {
-            'id': self.id,
-            'vehicle_id': self.vehicle_id,
-            'user_id': self.user_id
-        }
+        return f'<Favorite {self.kind} {self.item_id} of user {self.user_id}>'
+
+    serialize = serializer('id', 'user_id', 'kind', 'item_id', 'created_at')
+
+class FavoriteCount(db.Model):
+    """
+    How many users have each item as a favorite, kept up to date by the same transactions
+    that write the favorite table. The (kind, count, item_id) index serves the most
+    favorited items of a kind in order.
+    """
+    __table_args__ = (
+        db.Index('ix_favorite_count_kind_count_item_id', 'kind', 'count', 'item_id'),
+    )
+    kind = db.Column(db.String(20), primary_key=True)
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
 
-class FavoritePlanets(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    planets_id = db.Column(db.Integer, db.ForeignKey('planets.id', ondelete='CASCADE'))
-    planets = db.relationship(Planets, primaryjoin=planets_id == Planets.id)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
-    User = db.relationship('User', primaryjoin=user_id == User.id)
-    
     def __repr__(self):
-        return '<FavoritePlanets %r' % self.id
-
-    def serialize(self):
-        return {
-            'id': self.id,
-            'planets_id': self.planets_id,
-            'user_id': self.user_id
-        }
+        return f'<FavoriteCount {self.kind} {self.item_id}: {self.count}>'
 
-
-class Favorites(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    character_id = db.Column(db.Integer, db.ForeignKey('character.id', ondelete='CASCADE'))
-    character = db.relationship(Character, primaryjoin=character_id == Character.id)
-    vehicles_id = db.Column(db.Integer, db.ForeignKey('vehicles.id', ondelete='CASCADE'))
-    vehicles = db.relationship(Vehicles, primaryjoin=vehicles_id == Vehicles.id)
-    planets_id = db.Column(db.Integer, db.ForeignKey('planets.id', ondelete='CASCADE'))
-    planets = db.relationship(Planets, primaryjoin=planets_id == Planets.id)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
-    User = db.relationship('User', primaryjoin=user_id == User.id)
-
-    def __repr__(self):
-        return '<Favorites %r' % self.id
-
-    def serialize(self):
-        return {
-            'id': self.id,
-            'planets_id': self.planets_id,
-            'character_id': self.character_id,
-            'vehicle_id': self.vehicles_id,
-            'user_id': self.user_id
-        }
\ No newline at end of file
+    serialize = serializer('kind', 'item_id', 'count')
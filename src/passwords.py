@@ -0,0 +1,150 @@
+"""
+Password hashing runs in a small process pool so the bcrypt work doesn't hold the GIL of
+the request worker. How many hashes run at once is bounded for the whole host: every hash
+takes one of PASSWORD_SLOTS lock files, shared by all the gunicorn workers, and when they
+are all taken the request fails fast with 503 instead of queueing behind them.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import flask_bcrypt
+
+from utils import APIException
+
+try:
+    import fcntl
+except ImportError:  # Windows, the slots are only shared by the threads of one process
+    fcntl = None
+
+BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# 0 hashes inline in the request thread, useful for development and tests
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', os.environ.get('GUNICORN_THREADS', 1)))
+# hashes running at once on the host, across every worker and app using the same directory
+PASSWORD_SLOTS = int(os.environ.get('PASSWORD_SLOTS', os.cpu_count() or 1))
+PASSWORD_SLOTS_DIR = os.environ.get('PASSWORD_SLOTS_DIR', os.path.join(tempfile.gettempdir(), 'starwars-password-slots'))
+PASSWORD_TIMEOUT = float(os.environ.get('PASSWORD_TIMEOUT', 10))
+
+
+def _hash_password(password, rounds):
+    return flask_bcrypt.generate_password_hash(password, rounds).decode('utf-8')
+
+def _check_password(pw_hash, password):
+    return flask_bcrypt.check_password_hash(pw_hash, password)
+
+
+class HashSlots:
+    """
+    PASSWORD_SLOTS lock files, a hash holds an exclusive flock on one of them. The kernel
+    drops the lock when its process dies, so a killed worker never leaks a slot.
+    """
+    def __init__(self, count=PASSWORD_SLOTS, directory=PASSWORD_SLOTS_DIR):
+        self.count = count
+        self.directory = directory
+        self._local = threading.BoundedSemaphore(count) if fcntl is None else None
+
+    def acquire(self):
+        """
+        A held slot, None when every slot is taken.
+        """
+        if fcntl is None:
+            return self._local if self._local.acquire(blocking=False) else None
+        os.makedirs(self.directory, exist_ok=True)
+        # start from a different slot in every process so they don't all try the first one
+        start = os.getpid() % self.count
+        for index in range(self.count):
+            fd = os.open(os.path.join(self.directory, f'slot-{(start + index) % self.count}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def release(self, slot):
+        if fcntl is None:
+            slot.release()
+        else:
+            # closing the only descriptor of the open file releases its flock
+            os.close(slot)
+
+
+class PasswordHasher:
+    def __init__(self, rounds=BCRYPT_LOG_ROUNDS, workers=PASSWORD_WORKERS, slots=None, timeout=PASSWORD_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = slots or HashSlots()
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # created on first use, so every gunicorn worker owns its pool instead of
+        # inheriting the parent's through fork
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context('fork') if fcntl is not None else None
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+                # the first job forks every process of the pool. It runs before this worker
+                # takes a slot, a process forked while one is held would keep its lock file
+                self._executor.submit(int).result()
+            return self._executor
+
+    def _discard_executor(self, executor):
+        # a pool with a dead process takes no more work, the next hash starts a new one
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _run(self, fn, *args):
+        executor = self._get_executor() if self.workers > 0 else None
+        slot = self.slots.acquire()
+        if slot is None:
+            raise APIException("The server is busy, try again in a moment", status_code=503)
+        if executor is None:
+            try:
+                return fn(*args)
+            finally:
+                self.slots.release(slot)
+
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException as error:
+            self.slots.release(slot)
+            if isinstance(error, BrokenProcessPool):
+                self._discard_executor(executor)
+                raise APIException("The server is busy, try again in a moment", status_code=503)
+            raise
+        # a hash that times out keeps running in the pool, so it keeps its slot until it ends
+        future.add_done_callback(lambda future: self.slots.release(slot))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise APIException("The server is busy, try again in a moment", status_code=503)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            raise APIException("The server is busy, try again in a moment", status_code=503)
+
+    def generate_password_hash(self, password):
+        return self._run(_hash_password, password, self.rounds)
+
+    def check_password_hash(self, pw_hash, password):
+        return self._run(_check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        # bcrypt hashes look like $2b$<rounds>$<salt and hash>
+        if isinstance(pw_hash, bytes):
+            pw_hash = pw_hash.decode('utf-8')
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+passwords = PasswordHasher()
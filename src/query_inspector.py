@@ -0,0 +1,57 @@
+"""
+Development instrumentation for the SQL each request runs. Every statement is reduced to
+its shape (literals and IN lists removed); when one shape repeats more than
+SQL_REPEAT_THRESHOLD times in the same request it's almost always an N+1 query, so we log
+a warning, or raise when the app is in testing mode.
+"""
+import os
+import re
+from collections import Counter
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 5))
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETER_LISTS = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+
+
+class RepeatedQueryError(Exception):
+    pass
+
+
+def statement_shape(statement):
+    shape = _LITERALS.sub('?', statement)
+    shape = _PARAMETER_LISTS.sub('(...)', shape)
+    return ' '.join(shape.split())
+
+def record_statement(conn, cursor, statement, parameters, context, executemany):
+    # batched writes repeat on purpose, N+1 problems are reads
+    if has_request_context() and statement.lstrip()[:6].upper() == 'SELECT':
+        g.setdefault('sql_shapes', Counter())[statement_shape(statement)] += 1
+
+def is_enabled(app):
+    default = app.debug or app.testing or os.environ.get('FLASK_ENV') == 'development'
+    return os.environ.get('SQL_INSTRUMENTATION', str(default)).lower() in ('1', 'true', 'yes')
+
+
+def setup_query_inspector(app):
+    if not is_enabled(app):
+        return
+    event.listen(Engine, 'before_cursor_execute', record_statement)
+
+    @app.after_request
+    def inspect_queries(response):
+        # the statement count and time are collected for every request by the metrics hooks
+        response.headers['X-DB-Query-Count'] = str(g.get('db_queries', 0))
+        response.headers['X-DB-Query-Time'] = '%.6f' % g.get('db_time', 0.0)
+
+        repeated = [(shape, count) for shape, count in g.get('sql_shapes', Counter()).items() if count > SQL_REPEAT_THRESHOLD]
+        for shape, count in repeated:
+            message = f"Possible N+1 query: the same statement ran {count} times in one request: {shape}"
+            if app.testing:
+                raise RepeatedQueryError(message)
+            app.logger.warning(message)
+        return response
@@ -0,0 +1,185 @@
+"""
+Read replicas. With DB_REPLICA_URLS set, the SELECTs of GET and HEAD requests go to the
+replicas, round-robin with one replica per request, and everything else goes to the
+primary: writes and every read after them in the same session, requests with other
+methods and anything that runs outside of a request (CLI commands, migrations).
+
+After a write the client gets a cookie that keeps its reads on the primary for
+REPLICA_READ_YOUR_WRITES seconds, so it sees its own writes while the replicas catch up.
+The tables this worker just wrote are read from the primary for the same time, otherwise
+the caches it invalidated could be filled again from a replica that is behind.
+A replica whose connections fail is out of the rotation for REPLICA_EJECT_SECONDS and
+then tried again, and the read that failed runs again on the primary. With every replica
+out the reads go to the primary.
+
+The replicas get their tables through replication, db.create_all() only creates them on
+the primary. Locally, copy the primary SQLite file to every replica file once it has its
+tables and rows:
+
+    $ cp primary.db replica1.db && cp primary.db replica2.db
+    $ export DB_REPLICA_URLS=sqlite:////path/to/replica1.db,sqlite:////path/to/replica2.db
+
+benchmarks/replica_reads.py does this with temporary files and checks the routing.
+"""
+import itertools
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, jsonify
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.sql import Select, CompoundSelect
+from sqlalchemy.sql.util import find_tables
+
+DB_REPLICA_URLS = [url.strip() for url in os.environ.get('DB_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_READ_YOUR_WRITES = int(os.environ.get('REPLICA_READ_YOUR_WRITES', 5))
+REPLICA_EJECT_SECONDS = int(os.environ.get('REPLICA_EJECT_SECONDS', 30))
+PRIMARY_COOKIE = 'db_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def replica_binds(urls=DB_REPLICA_URLS):
+    # Flask-SQLAlchemy binds, no model is bound to them so they only ever serve reads
+    return dict((f'replica_{index}', url) for index, url in enumerate(urls))
+
+
+class ReplicaSet:
+    def __init__(self, keys, eject_seconds=REPLICA_EJECT_SECONDS, window=REPLICA_READ_YOUR_WRITES):
+        self.keys = list(keys)
+        self.eject_seconds = eject_seconds
+        self.window = window
+        self.ejected_until = {}
+        self.written_at = {}
+        self.sessions = dict((key, 0) for key in self.keys)
+        self.ejections = dict((key, 0) for key in self.keys)
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+
+    def pick(self):
+        """
+        Next replica in turn that isn't ejected, None when all of them are.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for _ in self.keys:
+                key = self.keys[next(self._turn) % len(self.keys)]
+                if self.ejected_until.get(key, 0) <= now:
+                    self.sessions[key] += 1
+                    return key
+        return None
+
+    def eject(self, key):
+        with self._lock:
+            self.ejected_until[key] = time.monotonic() + self.eject_seconds
+            self.ejections[key] += 1
+
+    def mark_written(self, table):
+        self.written_at[table] = time.monotonic()
+
+    def recently_written(self, tables):
+        since = time.monotonic() - self.window
+        return any(self.written_at.get(table.name, 0) > since for table in tables)
+
+    def stats(self):
+        now = time.monotonic()
+        return dict((key, {
+            "healthy": self.ejected_until.get(key, 0) <= now,
+            "sessions": self.sessions[key],
+            "ejections": self.ejections[key]
+        }) for key in self.keys)
+
+
+def is_read(clause):
+    return isinstance(clause, (Select, CompoundSelect)) and getattr(clause, '_for_update_arg', None) is None
+
+def is_replica_failure(error, is_disconnect=False):
+    # lost connections and refused ones, a replica missing a table is broken as well
+    return is_disconnect or isinstance(error, exc.OperationalError)
+
+def client_pinned_to_primary():
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class RoutingSession(Session):
+    """
+    db.session: sends the reads of read-only requests to a replica, see the module docstring.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replicas = current_app.extensions.get('replicas') if bind is None else None
+        if replicas is not None:
+            if self._flushing or not is_read(clause):
+                self.info['wrote'] = True
+                if has_request_context():
+                    g.db_wrote = True
+            elif self._reads_from_replica(replicas, clause):
+                if 'replica' not in self.info:
+                    self.info['replica'] = replicas.pick()
+                if self.info['replica'] is not None:
+                    self.info['on_replica'] = True
+                    return self._db.engines[self.info['replica']]
+        return Session.get_bind(self, mapper, clause=clause, bind=bind, **kwargs)
+
+    def execute(self, statement, *args, **kwargs):
+        return self._fall_back_to_primary(Session.execute, statement, *args, **kwargs)
+
+    def scalar(self, statement, *args, **kwargs):
+        return self._fall_back_to_primary(Session.scalar, statement, *args, **kwargs)
+
+    def scalars(self, statement, *args, **kwargs):
+        return self._fall_back_to_primary(Session.scalars, statement, *args, **kwargs)
+
+    def _fall_back_to_primary(self, method, *args, **kwargs):
+        self.info['on_replica'] = False
+        try:
+            return method(self, *args, **kwargs)
+        except exc.DBAPIError as error:
+            if not self.info['on_replica'] or not is_replica_failure(error, error.connection_invalidated):
+                raise
+            # the replica was ejected when it failed, the session only read so far and
+            # reads the same again from the primary
+            self.rollback()
+            self.info['replica'] = None
+            return method(self, *args, **kwargs)
+
+    def _reads_from_replica(self, replicas, clause):
+        if not has_request_context() or request.method not in READ_METHODS or self.info.get('wrote'):
+            return False
+        return not client_pinned_to_primary() and not replicas.recently_written(find_tables(clause))
+
+
+def ejector(replicas, key):
+    def eject_on_failure(context):
+        if is_replica_failure(context.sqlalchemy_exception, context.is_disconnect):
+            current_app.logger.warning(f"Read replica {key} failed and is out for {replicas.eject_seconds} s: {context.original_exception}")
+            replicas.eject(key)
+    return eject_on_failure
+
+
+def setup_replicas(app):
+    keys = [key for key in app.config.get('SQLALCHEMY_BINDS') or {} if key.startswith('replica_')]
+    if not keys:
+        return
+    replicas = app.extensions['replicas'] = ReplicaSet(keys)
+    with app.app_context():
+        engines = app.extensions['sqlalchemy'].engines
+        for key in keys:
+            event.listen(engines[key], 'handle_error', ejector(replicas, key))
+
+    # imported here because the cache imports the models, which import this module
+    from cache import commit_hooks
+    commit_hooks.append(lambda table, id: replicas.mark_written(table))
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if g.get('db_wrote'):
+            until = time.time() + replicas.window
+            response.set_cookie(PRIMARY_COOKIE, '%.3f' % until, max_age=replicas.window, httponly=True, samesite='Lax')
+        return response
+
+    @app.route('/stats/replicas', methods=['GET'])
+    def get_replica_stats():
+        return jsonify(replicas.stats()), 200
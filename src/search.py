@@ -0,0 +1,193 @@
+"""
+Name search over planets, characters and vehicles served from memory.
+
+Each worker keeps, per kind, a sorted list of (term, id, rank) where the terms are the
+lowercased searchable values and every word inside them. A query is a bisect to the first
+term with the query as prefix, followed by a walk over the matching slice. The lists are
+built on the first search and follow the commits of this worker through the cache commit
+hooks, a full reload every SEARCH_INDEX_TTL seconds picks up what other workers wrote.
+The searches keep using the current lists while a reload runs, the new ones replace them
+once they are built.
+"""
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from models import db, Planets, Character, Vehicles
+from cache import commit_hooks
+
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', 60))
+SEARCH_SCAN_MAX = 1000
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# rank of a match: the whole value equals the query, the whole value starts with it,
+# or one of the words inside starts with it
+EXACT, PREFIX, WORD_PREFIX = 0, 1, 2
+
+_WORDS = re.compile(r"[\w']+")
+
+
+def character_name(character):
+    return f"{character.name} {character.last_name}"
+
+SEARCH_KINDS = {
+    "planet": (Planets, (Planets.name,), lambda planet: planet.name),
+    "character": (Character, (Character.name, Character.last_name), character_name),
+    "vehicle": (Vehicles, (Vehicles.name, Vehicles.model), lambda vehicle: vehicle.name),
+}
+
+
+def row_terms(values):
+    terms = set()
+    for value in values:
+        if not value:
+            continue
+        value = value.lower()
+        terms.add((value, PREFIX))
+        for word in _WORDS.findall(value)[1:]:
+            terms.add((word, WORD_PREFIX))
+    return terms
+
+
+class KindIndex:
+    def __init__(self, kind, model, columns, display):
+        self.kind = kind
+        self.model = model
+        self.columns = columns
+        self.display = display
+        self.entries = []
+        self.names = {}
+        self.terms = {}
+        self.pending = set()
+        self.built_at = None
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+
+    def _load(self, ids=None):
+        # (id, *columns) tuples, loading them takes no ORM instances and none of the index locks
+        query = db.session.query(self.model.id, *self.columns)
+        if ids is not None:
+            query = query.filter(self.model.id.in_(ids))
+        return query.all()
+
+    def _index_row(self, row):
+        """
+        (name, terms) of a loaded row.
+        """
+        terms = row_terms(row[1:])
+        # the full name of a character is searchable as a whole too
+        terms.add((self.display(row).lower(), PREFIX))
+        return self.display(row), terms
+
+    def _add(self, row):
+        self.names[row.id], self.terms[row.id] = self._index_row(row)
+        for term, rank in self.terms[row.id]:
+            insort(self.entries, (term, row.id, rank))
+
+    def _remove(self, id):
+        for term, rank in self.terms.pop(id, ()):
+            position = bisect_left(self.entries, (term, id, rank))
+            if position < len(self.entries) and self.entries[position] == (term, id, rank):
+                del self.entries[position]
+        self.names.pop(id, None)
+
+    def _take_pending(self):
+        with self._lock:
+            ids, self.pending = self.pending, set()
+        return ids
+
+    def _restore_pending(self, ids):
+        with self._lock:
+            self.pending |= ids
+
+    def _rebuild(self):
+        covered = self._take_pending()
+        try:
+            rows = self._load()
+        except BaseException:
+            self._restore_pending(covered)
+            raise
+        entries, names, terms = [], {}, {}
+        for row in rows:
+            names[row.id], terms[row.id] = self._index_row(row)
+            entries.extend((term, row.id, rank) for term, rank in terms[row.id])
+        entries.sort()
+        # what was committed while the rows loaded is still pending and goes over the new index
+        with self._lock:
+            self.entries, self.names, self.terms = entries, names, terms
+            self.built_at = time.monotonic()
+
+    def _update(self):
+        ids = self._take_pending()
+        try:
+            rows = self._load(ids)
+        except BaseException:
+            self._restore_pending(ids)
+            raise
+        with self._lock:
+            for id in ids:
+                self._remove(id)
+            for row in rows:
+                self._add(row)
+
+    def refresh(self):
+        """
+        One thread at a time loads rows, outside of the lock the searches take, and the
+        searches that come meanwhile use the index as it is. Only the first build is waited
+        for, before it there is nothing to search.
+        """
+        if not self._loading.acquire(blocking=self.built_at is None):
+            return
+        try:
+            if self.built_at is None or None in self.pending or time.monotonic() - self.built_at > SEARCH_INDEX_TTL:
+                self._rebuild()
+            elif self.pending:
+                self._update()
+        finally:
+            self._loading.release()
+
+    def mark_changed(self, id):
+        with self._lock:
+            self.pending.add(id)
+
+    def search(self, query):
+        """
+        {id: (rank, name)} of the rows with a term that starts with the query.
+        """
+        self.refresh()
+        matches = {}
+        with self._lock:
+            position = bisect_left(self.entries, (query,))
+            end = min(len(self.entries), position + SEARCH_SCAN_MAX)
+            while position < end and self.entries[position][0].startswith(query):
+                term, id, rank = self.entries[position]
+                if term == query and rank == PREFIX:
+                    rank = EXACT
+                matches[id] = min(rank, matches.get(id, rank))
+                position += 1
+            return dict((id, (rank, self.names[id])) for id, rank in matches.items())
+
+
+indexes = dict((kind, KindIndex(kind, *config)) for kind, config in SEARCH_KINDS.items())
+tables = dict((index.model.__table__.name, index) for index in indexes.values())
+
+
+def follow_commit(table, id):
+    if table in tables:
+        tables[table].mark_changed(id)
+
+commit_hooks.append(follow_commit)
+
+
+def search(query, limit=SEARCH_DEFAULT_LIMIT):
+    query = ' '.join(query.lower().split())
+    results = []
+    for kind, index in indexes.items():
+        for id, (rank, name) in index.search(query).items():
+            results.append((rank, len(name), name.lower(), kind, id, name))
+    results.sort()
+    return [{"type": kind, "id": id, "name": name, "match": ("exact", "prefix", "word")[rank]}
+            for rank, length, sort_name, kind, id, name in results[:limit]]
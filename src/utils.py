@@ -1,4 +1,23 @@
-from flask import jsonify, url_for
+import base64
+import json
+import operator
+import re
+
+from flask import jsonify, url_for, request, current_app, Response, stream_with_context
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+FILTER_ARG = re.compile(r'^filter\[(\w+)\](?:\[(\w+)\])?$')
+FILTER_OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
 
 class APIException(Exception):
     status_code = 400
@@ -15,13 +34,241 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def encode_cursor(item, sort=None):
+    # the cursor is opaque for the client, it only has to send it back as ?after=
+    cursor = {"id": item.id}
+    if sort is not None:
+        cursor.update(sort=request.args.get('sort'), value=getattr(item, sort[0]))
+    raw = json.dumps(cursor).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        cursor["id"] = int(cursor["id"])
+        # the sort columns are all integers, anything else would only fail in the database
+        value = cursor.get("value")
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError(value)
+        return cursor
+    except (ValueError, KeyError, TypeError):
+        raise APIException("Invalid pagination cursor", status_code=400)
+
+def get_page_size():
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise APIException("limit must be a number", status_code=400)
+    if limit < 1:
+        raise APIException("limit must be greater than 0", status_code=400)
+    return min(limit, MAX_PAGE_SIZE)
+
+def requested_ids():
+    """
+    Ids asked with ?ids=1,5,9 in the order they were asked, or None for a regular list.
+    """
+    ids = request.args.get('ids')
+    if ids is None:
+        return None
+    try:
+        ids = [int(id) for id in ids.split(',') if id.strip()]
+    except ValueError:
+        raise APIException("ids must be a comma separated list of numbers", status_code=400)
+    if not ids:
+        raise APIException("ids can't be empty", status_code=400)
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_PAGE_SIZE:
+        raise APIException(f"You can ask for up to {MAX_PAGE_SIZE} ids at once", status_code=400)
+    return ids
+
+def apply_filters(query, model):
+    """
+    Applies ?filter[column][op]=value (or ?filter[column]=value for eq) over the
+    model's filterable_columns, all of them are indexed integer columns.
+    """
+    for arg, value in request.args.items(multi=True):
+        match = FILTER_ARG.match(arg)
+        if match is None:
+            continue
+        name, op = match.group(1), match.group(2) or 'eq'
+        if name not in getattr(model, 'filterable_columns', ()):
+            raise APIException(f"You can't filter by {name}", status_code=400)
+        if op not in FILTER_OPERATORS:
+            raise APIException("The filter operator must be one of " + ", ".join(FILTER_OPERATORS), status_code=400)
+        try:
+            value = int(value)
+        except ValueError:
+            raise APIException(f"filter[{name}] must be a number", status_code=400)
+        query = query.filter(FILTER_OPERATORS[op](getattr(model, name), value))
+    return query
+
+def requested_sort(model):
+    """
+    (column name, descending) from ?sort=column or ?sort=-column, None to sort by id.
+    """
+    sort = request.args.get('sort')
+    if not sort:
+        return None
+    name = sort.lstrip('-')
+    if name != 'id' and name not in getattr(model, 'filterable_columns', ()):
+        raise APIException(f"You can't sort by {name}", status_code=400)
+    if name == 'id' and not sort.startswith('-'):
+        return None
+    return name, sort.startswith('-')
+
+def paginate(query, model):
+    """
+    Keyset pagination: every page is a range scan over an index, like
+    `WHERE id > :after ORDER BY id LIMIT :limit`, so deep pages cost the same as the first one.
+    Returns the items of the page and the cursor of the next page (None on the last page).
+    """
+    limit = get_page_size()
+    sort = requested_sort(model)
+    after = request.args.get('after')
+    cursor = decode_cursor(after) if after else None
+    if cursor is not None and cursor.get('sort') != (request.args.get('sort') if sort else None):
+        raise APIException("The cursor belongs to a different sort", status_code=400)
+
+    if sort is None:
+        if cursor is not None:
+            query = query.filter(model.id > cursor['id'])
+        items = query.order_by(model.id).limit(limit + 1).all()
+    else:
+        # rows with a value come first in (column, id) order and the NULLs last in id order.
+        # Each part is its own range scan, which keeps the order the same on every database.
+        name, descending = sort
+        column = getattr(model, name)
+        items = []
+        if cursor is None or cursor.get('value') is not None:
+            ranked = query.filter(column.isnot(None))
+            if cursor is not None:
+                value = cursor.get('value')
+                past = column < value if descending else column > value
+                ranked = ranked.filter(or_(past, and_(column == value, model.id > cursor['id'])))
+            items = ranked.order_by(column.desc() if descending else column, model.id).limit(limit + 1).all()
+        if len(items) <= limit:
+            unranked = query.filter(column.is_(None))
+            if cursor is not None and cursor.get('value') is None:
+                unranked = unranked.filter(model.id > cursor['id'])
+            items += unranked.order_by(model.id).limit(limit + 1 - len(items)).all()
+
+    if len(items) <= limit:
+        return items, None
+
+    items = items[:limit]
+    return items, encode_cursor(items[-1], sort)
+
+def add_pagination_headers(response, next_cursor):
+    if next_cursor is not None:
+        args = request.args.to_dict()
+        args['after'] = next_cursor
+        args['limit'] = get_page_size()
+        next_url = url_for(request.endpoint, _external=True, **request.view_args, **args)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def wants_stream(req=None):
+    if req is None:
+        req = request
+    if req.args.get('stream') in ('1', 'true'):
+        return True
+    return req.accept_mimetypes.best == 'application/x-ndjson'
+
+def public_fields(model):
+    # the keys serialize() emits, anything else (like the user password) is never selectable
+    return model.serialize.fields
+
+def requested_fields(model):
+    """
+    Fields asked with ?fields=name,population, or None when the client wants every field.
+    """
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in public_fields(model)]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400)
+    return list(dict.fromkeys(fields))
+
+def serialized_attributes(model, fields):
+    # (key, attribute) of what serialize() emits, or of the requested fields only
+    pairs = list(zip(model.serialize.fields, model.serialize.attributes))
+    if fields is None:
+        return pairs
+    attributes = dict(pairs)
+    return [(field, attributes[field]) for field in fields]
+
+def select_rows(query, model, fields=None):
+    """
+    Turns a query over the model into one over plain column rows: only the serialized
+    columns are SELECTed and no ORM instances (identity map, change tracking) are built.
+    """
+    attributes = [attribute for key, attribute in serialized_attributes(model, fields)]
+    # the id and the sort column are needed for the next page cursor even when they aren't returned
+    sort = requested_sort(model)
+    for extra in ['id'] + ([sort[0]] if sort else []):
+        if extra not in attributes:
+            attributes.append(extra)
+    return query.with_entities(*[getattr(model, attribute) for attribute in attributes])
+
+def serialize_rows(rows, model, fields=None):
+    # rows come from select_rows, their first columns are the serialized ones in order
+    keys = [key for key, attribute in serialized_attributes(model, fields)]
+    return [dict(zip(keys, row)) for row in rows]
+
+def pick_fields(serialized, fields):
+    if fields is None:
+        return serialized
+    return dict((field, serialized[field]) for field in fields)
+
+def iter_table(query, model, fields=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Walks the whole table in primary key order, one batch of plain rows at a time,
+    yielding serialized rows.
+    """
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else query.filter(model.id > last_id)
+        batch = batch_query.order_by(model.id).limit(batch_size).all()
+        for row in serialize_rows(batch, model, fields):
+            yield row
+        if len(batch) < batch_size:
+            return
+        last_id = batch[-1].id
+
+def stream_response(query, model, key=None, fields=None):
+    """
+    Streams the table as NDJSON (Accept: application/x-ndjson) or as the same JSON
+    document the list endpoint returns, written to the socket row by row.
+    """
+    rows = iter_table(select_rows(query, model, fields), model, fields)
+    dumps = current_app.json.dumps
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        body = (dumps(row) + "\n" for row in rows)
+        return Response(stream_with_context(body), mimetype='application/x-ndjson')
+
+    def generate():
+        yield '{"%s": [' % key if key else '['
+        separator = ''
+        for row in rows:
+            yield separator + dumps(row)
+            separator = ','
+        yield ']}' if key else ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if 'admin' in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
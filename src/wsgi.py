@@ -1,7 +1,11 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
+# gunicorn reads its settings from gunicorn.conf.py next to this file.
 
-from main import app as application
+from main import create_app
+
+# the web workers never run migrations, `flask db` builds its own app that does
+application = create_app({"MIGRATE_ENABLED": False})
 
 if __name__ == "__main__":
     application.run()